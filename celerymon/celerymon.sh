@@ -3,8 +3,6 @@
 if [ `ps -ef | grep "python.*celery.*worker.*$1" | wc -l` -lt 2 ]
 then
     echo '['`date`'] Celery processes appear to be down, restarting:' >&2
-    rm -rf /tmp/namecheap.lock
-    rm -rf /tmp/mozapi.lock
     /etc/init.d/celeryd restart
 else
     echo '['`date`'] Celery processes appear to running, no restart required.' >&2
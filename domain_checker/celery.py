@@ -27,10 +27,6 @@ app.conf.update(
             'task' : 'main.tasks.check_project_tasks',
             'schedule' : crontab(minute='*/5'),
         },
-        'moz_api' : {
-            'task' : 'main.tasks.update_metrics',
-            'schedule' : crontab(minute='*/5'),
-        },
         'check_moz_updatetime' : {
             'task' : 'main.tasks.check_moz_update',
             'schedule' : crontab(hour='0'),
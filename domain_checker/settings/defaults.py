@@ -172,6 +172,10 @@ CACHES = {
     }
 }
 
+# Lock and rate limiter classes shared by all workers (on any host) calling the external APIs, see main.locks
+LOCK_BACKEND = 'main.locks.DatabaseLock'
+RATE_LIMITER_BACKEND = 'main.locks.DatabaseRateLimiter'
+
 PASSWORD_HASHERS = (
     'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
     'django.contrib.auth.hashers.BCryptPasswordHasher',
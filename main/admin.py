@@ -17,7 +17,7 @@ class UserProjectAdmin(admin.ModelAdmin):
         return obj.updated
 
     def num_domains(self, obj):
-        return len(ProjectDomain.objects.filter(project_id=obj.id))
+        return obj.get_counts().domains_total
 
     def is_complete(self, obj):
         return obj.is_complete
@@ -37,10 +37,10 @@ class UploadedFileAdmin(admin.ModelAdmin):
         return User.objects.get(id=UserProject.objects.get(id=obj.project_id).user_id).username
 
     def length(self, obj):
-        return len(obj.filedata)
+        return obj.datafile.size if obj.datafile else len(obj.filedata)
 
     def num_domains(self, obj):
-        return len(ProjectDomain.objects.filter(project_id=UserProject.objects.get(id=obj.project_id).id))
+        return obj.project.get_counts().domains_total
 
 admin.site.register(UserProject, UserProjectAdmin)
 # admin.site.register(ProjectDomain)
@@ -0,0 +1,102 @@
+"""
+Domain checker Namecheap API dispatch for the main module.
+
+.. moduleauthor:: Chris Davoren <cdavoren@gmail.com>
+"""
+from __future__ import absolute_import
+from multiprocessing.pool import ThreadPool
+
+import collections
+import requests
+from requests.adapters import HTTPAdapter
+
+class NamecheapChecker(object):
+    """
+    Pipelined Namecheap availability checker.  Calls are made on a small pool of threads sharing one keep-alive HTTP session, so that several batches can be in flight at once (within the rate limit) while the caller parses and stores the results of earlier batches.
+    """
+    def __init__(self, api_url, params, limiter, in_flight=1, retries=3):
+        """
+        Args:
+          api_url (str): The Namecheap API call URL.
+          params (list): Parameters for each call (excluding the domain list).
+          limiter (callable): Called before each call (including each retry) is dispatched, blocking until the call is allowed by the rate limit.
+          in_flight (int): Maximum number of calls in flight at once.
+          retries (int): Number of attempts made for a call before a connection error is raised.
+        """
+        self.api_url = api_url
+        self.params = params
+        self.limiter = limiter
+        self.in_flight = max(in_flight, 1)
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.mount(u'http://', HTTPAdapter(pool_maxsize=self.in_flight))
+        self.session.mount(u'https://', HTTPAdapter(pool_maxsize=self.in_flight))
+
+    def fetch(self, domain_str):
+        """
+        Makes a single call to the Namecheap API.  Connection errors are raised to run, which retries the call.
+
+        Args:
+          domain_str (str): Comma-separated list of domains to check.
+
+        Returns:
+          A tuple of the HTTP status code and the raw (UTF-8 encoded) response.
+        """
+        params = self.params + [(u'DomainList', domain_str)]
+        r = self.session.get(self.api_url, params=params)
+        try:
+            return (r.status_code, r.text.encode(u'utf-8'))
+        finally:
+            r.close()
+
+    def dispatch(self, pool, domains, attempts):
+        """
+        Waits for the limiter, then starts a call for a batch of domains on the pool.
+
+        Args:
+          pool (ThreadPool): The pool making the calls.
+          domains (dict): The batch of domains to check (keyed by domain name).
+          attempts (int): Number of the attempt being made, including this one.
+
+        Returns:
+          A tuple of the batch dictionary, the attempt number and the pending result of the call.
+        """
+        self.limiter()
+        return (domains, attempts, pool.apply_async(self.fetch, (u','.join(domains.keys()),)))
+
+    def run(self, next_batch):
+        """
+        Generator that dispatches batches of domains and yields the result of each call, in the order the batches were dispatched.  New batches are dispatched before each result is yielded, so the caller's processing overlaps with calls still in flight.  A call that fails to connect is dispatched again (through the limiter, so retries count against the rate limit) after the calls already pending, up to the set number of attempts.
+
+        Args:
+          next_batch (callable): Called with the set of domain names currently in flight, and returns a dictionary of the next domains to check (keyed by domain name), or an empty dictionary if there is nothing left to dispatch.
+
+        Yields:
+          A tuple of the batch dictionary, the HTTP status code and the raw response.
+        """
+        pool = ThreadPool(self.in_flight)
+        pending = collections.deque()
+        in_flight = set()
+        try:
+            while True:
+                while len(pending) < self.in_flight:
+                    domains = next_batch(in_flight)
+                    if len(domains) == 0:
+                        break
+                    in_flight.update(domains.keys())
+                    pending.append(self.dispatch(pool, domains, 1))
+                if len(pending) == 0:
+                    break
+                (domains, attempts, result) = pending.popleft()
+                try:
+                    (status_code, rtext) = result.get()
+                except requests.exceptions.ConnectionError:
+                    if attempts >= self.retries:
+                        raise
+                    pending.append(self.dispatch(pool, domains, attempts + 1))
+                    continue
+                yield (domains, status_code, rtext)
+                in_flight.difference_update(domains.keys())
+        finally:
+            pool.terminate()
+            self.session.close()
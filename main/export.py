@@ -0,0 +1,89 @@
+"""
+Domain checker project result export for the main module.
+
+.. moduleauthor:: Chris Davoren <cdavoren@gmail.com>
+"""
+from __future__ import absolute_import
+from main.models import ProjectDomain, URLMetrics
+
+import csv, json
+
+EXPORT_CHUNK_SIZE = 1000
+"""Number of project domains read per query while exporting"""
+EXPORT_FIELDS = [
+    u'domain',
+    u'state',
+    u'is_checked',
+    u'last_checked',
+    u'error',
+    u'mozrank_10',
+    u'links',
+    u'page_authority',
+    u'domain_authority',
+    u'metrics_updated']
+"""Fields of each exported row, in column order"""
+
+def export_rows(project, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Generator that yields the availability results and URL metrics of every domain of a project, as a dictionary of EXPORT_FIELDS.  Domains are read in chunks by keyset (the ID of the last domain of the previous chunk), along with the metrics of the available ones, so only one chunk is held in memory at a time whatever the size of the project.
+
+    Args:
+      project (UserProject): The project to export.
+      chunk_size (int): Number of domains read per query.
+    """
+    last_id = 0
+    while True:
+        domains = list(ProjectDomain.objects.filter(project=project, id__gt=last_id).order_by('id')[:chunk_size])
+        if len(domains) == 0:
+            break
+        last_id = domains[-1].id
+        available = [URLMetrics.get_key(d.domain) for d in domains if d.state == u'available']
+        metrics = dict([(URLMetrics.get_key(um.query_url), um) for um in URLMetrics.objects.filter(query_url__in=available)]) if len(available) > 0 else {}
+        for d in domains:
+            um = metrics.get(URLMetrics.get_key(d.domain))
+            yield {
+                u'domain' : d.domain,
+                u'state' : d.state,
+                u'is_checked' : d.is_checked,
+                u'last_checked' : d.last_checked.isoformat() if d.is_checked else None,
+                u'error' : d.error,
+                u'mozrank_10' : None if um is None else um.mozrank_10,
+                u'links' : None if um is None else um.links,
+                u'page_authority' : None if um is None else um.page_authority,
+                u'domain_authority' : None if um is None else um.domain_authority,
+                u'metrics_updated' : None if um is None or um.last_updated is None else um.last_updated.isoformat()}
+
+class LineBuffer(object):
+    """
+    File-like object whose write returns the written line rather than storing it, so a csv writer can be used to format one row at a time.
+    """
+    def write(self, value):
+        return value
+
+def export_csv(rows):
+    """
+    Generator that formats exported rows (see export_rows) as UTF-8 encoded CSV lines, starting with a header line.
+
+    Args:
+      rows (iterable): The exported rows.
+    """
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        yield writer.writerow([u'' if row[f] is None else unicode(row[f]).encode('utf-8') for f in EXPORT_FIELDS])
+
+def export_jsonl(rows):
+    """
+    Generator that formats exported rows (see export_rows) as JSON Lines, i.e. one JSON object per line.
+
+    Args:
+      rows (iterable): The exported rows.
+    """
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+EXPORT_FORMATS = {
+    u'csv' : (export_csv, 'text/csv'),
+    u'jsonl' : (export_jsonl, 'application/x-ndjson'),
+}
+"""Formatting generator and content type of each export format"""
@@ -0,0 +1,137 @@
+"""
+Domain checker locks and rate limiters for the main module.
+
+Workers on any number of hosts share the external APIs, so the locks and rate limiters they use must be shared by all of them.  The classes used are set by the LOCK_BACKEND and RATE_LIMITER_BACKEND settings (dotted paths), and default to the database backed implementations below.  Any replacement should provide the same methods.
+
+.. moduleauthor:: Chris Davoren <cdavoren@gmail.com>
+"""
+from __future__ import absolute_import
+from django.conf import settings
+from django.utils.module_loading import import_by_path
+from main.models import Lease, TokenBucket
+
+import os, socket, time, uuid
+
+DEFAULT_LOCK_BACKEND = 'main.locks.DatabaseLock'
+"""Lock class used if the LOCK_BACKEND setting is not given"""
+DEFAULT_RATE_LIMITER_BACKEND = 'main.locks.DatabaseRateLimiter'
+"""Rate limiter class used if the RATE_LIMITER_BACKEND setting is not given"""
+
+class LockLost(Exception):
+    """
+    Raised when a lease expired or was taken over by another process while it was in use.
+    """
+    pass
+
+class DatabaseLock(object):
+    """
+    Mutual exclusion lock backed by a database Lease.  The lock is only held for the given lease duration unless renewed, so a crashed holder never blocks other workers for longer than that.  Each acquisition is given a fencing token (see Lease).
+    """
+    POLL_INTERVAL = 1.0
+    """Number of seconds between attempts while waiting for the lock"""
+
+    def __init__(self, key, duration=300):
+        """
+        Args:
+          key (str): Name of the locked resource.
+          duration (float): Number of seconds the lock is held for unless renewed.
+        """
+        self.key = key
+        self.duration = duration
+        self.owner = u'%s:%d:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.token = None
+
+    def acquire(self, timeout=None):
+        """
+        Acquires the lock.
+
+        Args:
+          timeout (float): Time out for acquiring the lock in seconds (0 for a single attempt, None to wait indefinitely).
+
+        Returns:
+          Whether the lock was acquired.
+        """
+        start = time.time()
+        while True:
+            self.token = Lease.try_acquire(self.key, self.owner, self.duration)
+            if self.token is not None:
+                return True
+            if timeout is not None and time.time() - start + self.POLL_INTERVAL > timeout:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+    def renew(self):
+        """
+        Extends the lock for another lease duration.
+
+        Raises:
+          LockLost: If the lock has been taken over by another process.
+        """
+        if self.token is None or not Lease.renew(self.key, self.owner, self.token, self.duration):
+            raise LockLost(u'Lock "%s" has been lost' % self.key)
+
+    def check(self):
+        """
+        Checks that the lock is still held before writing under it.  This should be called inside the transaction that makes the writes, so the lock cannot change hands before they are committed.
+
+        Raises:
+          LockLost: If the lock has expired or been taken over by another process.
+        """
+        if self.token is None or not Lease.is_held(self.key, self.owner, self.token):
+            raise LockLost(u'Lock "%s" has been lost' % self.key)
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+        if self.token is not None:
+            Lease.release(self.key, self.owner, self.token)
+            self.token = None
+
+class DatabaseRateLimiter(object):
+    """
+    Token bucket rate limiter backed by a database TokenBucket.
+    """
+    def __init__(self, key, rate, burst=1):
+        """
+        Args:
+          key (str): Name of the rate limited resource.
+          rate (float): Number of calls allowed per second.
+          burst (int): Maximum number of calls allowed at once.
+        """
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def try_acquire(self):
+        """
+        Attempts to take permission for a single call.  Returns 0 if the call is allowed, otherwise the number of seconds until it will be.
+        """
+        return TokenBucket.try_acquire(self.key, self.rate, self.burst)
+
+    def acquire(self):
+        """
+        Takes permission for a single call, sleeping until it is allowed if necessary.
+        """
+        TokenBucket.acquire(self.key, self.rate, self.burst)
+
+def get_lock(key, duration=300):
+    """
+    Returns a lock on the given resource from the configured lock backend.
+
+    Args:
+      key (str): Name of the locked resource.
+      duration (float): Number of seconds the lock is held for unless renewed.
+    """
+    return import_by_path(getattr(settings, 'LOCK_BACKEND', DEFAULT_LOCK_BACKEND))(key, duration)
+
+def get_rate_limiter(key, rate, burst=1):
+    """
+    Returns a rate limiter for the given resource from the configured rate limiter backend.
+
+    Args:
+      key (str): Name of the rate limited resource.
+      rate (float): Number of calls allowed per second.
+      burst (int): Maximum number of calls allowed at once.
+    """
+    return import_by_path(getattr(settings, 'RATE_LIMITER_BACKEND', DEFAULT_RATE_LIMITER_BACKEND))(key, rate, burst)
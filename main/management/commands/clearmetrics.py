@@ -3,7 +3,7 @@ Deletes all URLMetrics in the database (intended for testing purposes only).
 """
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
-from main.models import UserProject, ProjectDomain, URLMetrics, ProjectMetrics
+from main.models import UserProject, ProjectDomain, URLMetrics, ProjectMetrics, ProjectCounts
 
 from optparse import make_option
 
@@ -16,5 +16,6 @@ class Command(BaseCommand):
             count += 1
             ProjectMetrics.objects.filter(urlmetrics=um).delete()
             um.delete()
-            
+        ProjectCounts.objects.update(metrics_total=0, metrics_checked=0)
+
         self.stdout.write(u'Total metric removed: %d' % count)
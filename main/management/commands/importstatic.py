@@ -42,6 +42,8 @@ class Command(BaseCommand):
                 t.type = ''
                 t.save()
                 tic += 1
+        if tic > 0:
+            TLD.changed()
         self.stdout.write('TLDs: Inserted %d row(s) (out of %d TLDs)' % (tic, len(tlds)))
 
         eic = 0
@@ -76,5 +78,7 @@ class Command(BaseCommand):
                 aso.choices = choices
                 aso.save()
                 sic += 1
+        if sic > 0:
+            AdminSetting.changed()
         self.stdout.write('Admin settings: Inserted %d row(s) (out of %d listed settings)' % (sic, len(ss)))
 
@@ -0,0 +1,117 @@
+"""
+Seeds a large throwaway project and reports the query plans (and timings) of the queries made on every batch by the domain checker and the metrics measurer, and of the paged project list.  Fails if any of them scans a full table rather than using an index, or sorts its rows rather than reading them in index order.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from main.models import UserProject, ProjectDomain, URLMetrics, ProjectMetrics, TLD
+from main.views import get_project_page_query, PROJECT_LIST_PAGE_SIZE
+
+from optparse import make_option
+import time
+
+SEED_BATCH_SIZE = 10000
+"""Number of rows inserted per query while seeding"""
+
+def get_hot_queries(project):
+    """
+    Returns a list of (name, queryset) of the per-batch queries made by the checker and measurer tasks for the given project, and of the project list of its user.
+    """
+    return [
+        (u'Project list: next page', get_project_page_query(project.user, project.id)[:PROJECT_LIST_PAGE_SIZE+1]),
+        (u'Checker: next unchecked domains', ProjectDomain.objects.filter(project=project, is_checked=False).exclude(domain__in=[u'seed1.queryplans', u'seed3.queryplans'])[:50]),
+        (u'Checker: any domains unchecked', ProjectDomain.objects.filter(project=project, is_checked=False)[:1]),
+        (u'Project: next page of domains', ProjectDomain.objects.filter(project=project, state__in=[u'unchecked', u'unavailable']).filter(Q(state__gt=u'unchecked') | Q(state=u'unchecked', domain__gt=u'seed1.queryplans')).order_by('state', 'domain')[:100]),
+        (u'Measurer: next unchecked metrics', ProjectMetrics.objects.filter(project=project, is_checked=False).select_related('urlmetrics').order_by('id')[:10]),
+        (u'Measurer: any metrics unchecked', ProjectMetrics.objects.filter(project=project, is_checked=False)[:1]),
+        (u'TLD lookup', TLD.objects.filter(domain=u'com')),
+        (u'URL metrics lookup', URLMetrics.objects.filter(query_url__in=[u'seed1.queryplans', u'seed2.queryplans'])),
+    ]
+
+def explain(queryset):
+    """
+    Returns the query plan of the given queryset as a tuple of a list of plan lines, whether any table is scanned in full (rather than through an index) and whether the rows are sorted (rather than read in index order).
+    """
+    (sql, params) = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        lines = [unicode(row[-1]) for row in cursor.fetchall()]
+        # Full scans are reported as "SCAN TABLE x" (or "SCAN x"), unless walked through an index
+        full_scan = any([l.startswith(u'SCAN') and u'INDEX' not in l for l in lines])
+        # Sorting (or grouping) is done in a temporary b-tree
+        sort = any([u'USE TEMP B-TREE' in l for l in lines])
+    elif connection.vendor == 'mysql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        cols = [d[0] for d in cursor.description]
+        rows = [dict(zip(cols, row)) for row in cursor.fetchall()]
+        lines = [u'%s: type=%s key=%s rows=%s extra=%s' % (r['table'], r['type'], r['key'], r['rows'], r['Extra']) for r in rows]
+        full_scan = any([r['type'] == 'ALL' for r in rows])
+        sort = any([u'Using filesort' in (r['Extra'] or u'') or u'Using temporary' in (r['Extra'] or u'') for r in rows])
+    else:
+        cursor.execute('EXPLAIN ' + sql, params)
+        lines = [unicode(row[0]) for row in cursor.fetchall()]
+        full_scan = any([u'Seq Scan' in l for l in lines])
+        sort = any([l.strip().startswith(u'Sort') or u'-> Sort' in l for l in lines])
+    return (lines, full_scan, sort)
+
+class Command(BaseCommand):
+    help = 'Reports query plans of the checker and measurer per-batch queries against a large seeded project'
+    option_list = BaseCommand.option_list + (
+        make_option('--rows',
+            action='store',
+            type='int',
+            dest='rows',
+            default=1000000,
+            help='Number of project domains (and metrics associations) to seed'),
+        )
+
+    def seed(self, rows):
+        """
+        Creates a throwaway project with the given number of domains (half of them checked), each with its own metrics record and association.
+        """
+        user = User.objects.create(username=u'queryplans_%d' % int(time.time()), email=u'queryplans@localhost')
+        project = UserProject(user=user, state=u'checking')
+        project.save()
+        now = timezone.now()
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            seeds = range(start, min(start+SEED_BATCH_SIZE, rows))
+            with transaction.atomic():
+                ProjectDomain.objects.bulk_create([ProjectDomain(project=project, domain=u'seed%d.queryplans' % i, original_link=u'', subdomains_preserved=False, is_checked=(i % 2 == 0), state=u'unavailable' if i % 2 == 0 else u'unchecked', last_checked=now) for i in seeds])
+                metrics = URLMetrics.get_or_create_all([u'seed%d.queryplans' % i for i in seeds])
+                ProjectMetrics.objects.bulk_create([ProjectMetrics(project=project, urlmetrics=metrics[u'seed%d.queryplans' % i], is_checked=(i % 2 == 0), is_extension=False) for i in seeds])
+        # Refresh planner statistics so plans reflect the seeded data
+        if connection.vendor in ('sqlite', 'postgresql'):
+            connection.cursor().execute('ANALYZE')
+        return (user, project)
+
+    def handle(self, *args, **options):
+        self.stdout.write('Seeding %d row(s)...' % options['rows'])
+        (user, project) = self.seed(options['rows'])
+        full_scans = []
+        sorts = []
+        try:
+            for (name, queryset) in get_hot_queries(project):
+                (lines, full_scan, sort) = explain(queryset)
+                start = time.time()
+                list(queryset)
+                elapsed = time.time() - start
+                self.stdout.write(u'%s (%.1f ms)%s%s' % (name, elapsed*1000, u' - FULL SCAN' if full_scan else u'', u' - SORT' if sort else u''))
+                for l in lines:
+                    self.stdout.write(u'  %s' % l)
+                if full_scan:
+                    full_scans.append(name)
+                if sort:
+                    sorts.append(name)
+        finally:
+            ProjectMetrics.objects.filter(project=project).delete()
+            ProjectDomain.objects.filter(project=project).delete()
+            URLMetrics.objects.filter(query_url__endswith=u'.queryplans').delete()
+            project.delete()
+            user.delete()
+        if len(full_scans) > 0:
+            raise CommandError(u'Queries scanning a full table: %s' % u', '.join(full_scans))
+        if len(sorts) > 0:
+            raise CommandError(u'Queries sorting their rows: %s' % u', '.join(sorts))
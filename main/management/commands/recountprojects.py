@@ -0,0 +1,26 @@
+"""
+Rebuilds the denormalised domain and metrics counts of projects (see ProjectCounts).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from main.models import UserProject, ProjectCounts
+
+class Command(BaseCommand):
+    args = '[project_id ...]'
+    help = 'Recounts the domains and metrics associations of the given projects (or all projects), repairing any drift in their progress counts'
+
+    def handle(self, *args, **options):
+        projects = UserProject.objects.all()
+        if len(args) > 0:
+            projects = projects.filter(id__in=[int(a) for a in args])
+        repaired = 0
+        for p in projects:
+            old = p.get_counts()
+            fields = [f.name for f in ProjectCounts._meta.fields if f.name != 'project']
+            with transaction.atomic():
+                new = ProjectCounts.recount(p)
+            drift = [u'%s %d -> %d' % (f, getattr(old, f), getattr(new, f)) for f in fields if getattr(old, f) != getattr(new, f)]
+            if len(drift) > 0:
+                repaired += 1
+                self.stdout.write(u'Project %d: %s' % (p.id, u', '.join(drift)))
+        self.stdout.write(u'Projects repaired: %d' % repaired)
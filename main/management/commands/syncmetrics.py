@@ -1,9 +1,9 @@
 """
-Restores any missing project domain/metrics associations.  If any duplicates are found, they are deleted.
+Restores any missing project domain/metrics associations.
 """
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
-from main.models import UserProject, ProjectDomain, URLMetrics, ProjectMetrics
+from main.models import UserProject, ProjectDomain, URLMetrics, ProjectMetrics, ProjectCounts
 
 from optparse import make_option
 
@@ -20,43 +20,27 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         pm_total = 0
         pm_checked = 0
-        dup_removed = 0
-        with transaction.atomic():
-            for p in UserProject.objects.all():
-                for pm in ProjectMetrics.objects.filter(project=p, is_extension=False):
-                    pm.delete()
+        for p in UserProject.objects.all():
+            # Each project is rebuilt in its own transaction, so locks are not held across the whole table
+            with transaction.atomic():
+                ProjectMetrics.objects.filter(project=p, is_extension=False).delete()
 
-                for pm in ProjectMetrics.objects.filter(project=p, is_extension=True):
-                    if pm.urlmetrics.is_uptodate():
-                        pm_checked += 1
-                        pm.is_checked = True
-                    else:
-                        pm.is_checked = False
+                extension_pms = ProjectMetrics.objects.filter(project=p, is_extension=True)
+                stale = URLMetrics.get_stale_filter(u'urlmetrics__')
+                stale_ids = list(extension_pms.filter(stale).values_list('id', flat=True))
+                extension_pms.filter(id__in=stale_ids).update(is_checked=False)
+                pm_checked += extension_pms.exclude(id__in=stale_ids).update(is_checked=True)
 
-                for pd in p.projectdomain_set.filter(state=u'available'):
-                    ums = URLMetrics.objects.filter(query_url=pd.domain).order_by(u'-last_updated')
-                    if len(ums) == 0:
-                        um = URLMetrics(query_url=pd.domain)
-                        um.save()
-                        pm = ProjectMetrics(project=p, urlmetrics=um, is_checked=False)
-                        pm.save()
-                    else:
-                        if len(ums) > 1:
-                            for dum in ums[1:]:
-                                dup_removed += 1
-                                dum.delete()
-                        um = ums[0]
-                        pm = ProjectMetrics(project=p, urlmetrics=um)
-                        if um.is_uptodate():
-                            pm.is_checked = True
-                            pm_checked += 1
-                        else:
-                            pm.is_checked = False
-                        pm.save()
-                    pm_total += 1
+                # Query URLs are unique, so each available domain has exactly one metrics record
+                domains = list(p.projectdomain_set.filter(state=u'available').values_list('domain', flat=True))
+                metrics = URLMetrics.get_or_create_all(domains)
+                pms = [ProjectMetrics(project=p, urlmetrics=metrics[domain], is_checked=metrics[domain].is_uptodate()) for domain in domains]
+                ProjectMetrics.objects.bulk_create(pms)
+                pm_total += len(pms)
+                pm_checked += len([pm for pm in pms if pm.is_checked])
+                ProjectCounts.recount(p)
         self.stdout.write('Statistics:')
         self.stdout.write('  Project metric links: %d' % pm_total)
         self.stdout.write('      Checked/up-to-date: %d' % pm_checked)
-        self.stdout.write('  Duplicate metric records removed: %d' % dup_removed)
-        self.stdout.write('  Total metric records (post-removal): %d' % (len(URLMetrics.objects.all())))
+        self.stdout.write('  Total metric records: %d' % URLMetrics.objects.count())
 
@@ -6,14 +6,78 @@ Domain checker model definitions for the main module.
 
 from django.contrib.auth.models import User
 from django.core.mail import send_mail
-from django.db import models, transaction
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Count
 from django.utils import timezone
 
-import hmac, hashlib, base64, time, datetime
+import hmac, hashlib, base64, time, datetime, collections, codecs, io
 
 MAX_DOMAIN_LENGTH = 255
 
-class URLMetrics(models.Model):
+class RaceSafeMixin(object):
+    """
+    Model methods for creating records that other processes (or hosts) may be creating at the same time.  Every insert is made in its own savepoint, so a duplicate (which raises IntegrityError) is rolled back without aborting any enclosing transaction.
+    """
+    @classmethod
+    def _insert_race_safe(cls, obj):
+        """
+        Inserts the given (unsaved) record, returning whether it was inserted (False if it already exists, e.g. created concurrently by another process).
+        """
+        try:
+            with transaction.atomic():
+                obj.save(force_insert=True)
+            return True
+        except IntegrityError:
+            return False
+
+    @classmethod
+    def _get_or_create_race_safe(cls, defaults=None, **lookup):
+        """
+        Ensures a record matching the given lookup exists, creating it (with the given defaults) if not.  Returns whether it was created.
+        """
+        if cls.objects.filter(**lookup).exists():
+            return False
+        kwargs = dict(lookup)
+        kwargs.update(defaults or {})
+        return cls._insert_race_safe(cls(**kwargs))
+
+    @classmethod
+    def _update_or_create_race_safe(cls, lookup, updates, defaults):
+        """
+        Applies the given updates (e.g. F() expressions) to the record matching the given lookup, or creates it with the given defaults if there is none.
+        """
+        if cls.objects.filter(**lookup).update(**updates) == 0:
+            kwargs = dict(lookup)
+            kwargs.update(defaults)
+            if not cls._insert_race_safe(cls(**kwargs)):
+                cls.objects.filter(**lookup).update(**updates)
+
+    @classmethod
+    def _bulk_create_race_safe(cls, objs):
+        """
+        Inserts the given (unsaved) records in bulk.  If any already exist, the rest are inserted one at a time.
+
+        Returns:
+          The list of records that were not inserted because they already exist.
+        """
+        if len(objs) == 0:
+            return []
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create(objs)
+            return []
+        except IntegrityError:
+            return [obj for obj in objs if not cls._insert_race_safe(obj)]
+
+    @classmethod
+    def _filter_latest(cls, **lookup):
+        """
+        Returns the list of records matching the given lookup, including any committed by another process since the enclosing transaction began.  A locking read is used, since under REPEATABLE READ isolation (the MySQL default) a plain read only sees the transaction's snapshot, which may predate a record that caused an IntegrityError.
+        """
+        with transaction.atomic():
+            return list(cls.objects.select_for_update().filter(**lookup))
+
+class URLMetrics(RaceSafeMixin, models.Model):
     """
     Moz API result for a single query URL.  See the Moz API documentation for information on what returned fields mean.
 
@@ -22,8 +86,8 @@ class URLMetrics(models.Model):
       Not all result fields may be filled; which ones are valid will depend on the data requested at the time of the API call.
 
     """
-    query_url = models.CharField(max_length=MAX_DOMAIN_LENGTH)
-    """The query URL of the check"""
+    query_url = models.CharField(max_length=MAX_DOMAIN_LENGTH, unique=True)
+    """The query URL of the check (unique, see URLMetrics.get_or_create_all)"""
     last_updated = models.DateTimeField(null=True, blank=True, default=None)
     """Date/time the URL was last checked"""
     extended_from = models.ForeignKey('self', null=True, blank=True, default=None)
@@ -102,6 +166,8 @@ class URLMetrics(models.Model):
         'Domain Authority' : ['pda', 68719476736],
     }
     """Field name to Moz API call bitmask/code map"""
+    result_attrs = dict([(code, name.lower().replace(' ', '_')) for (name, (code, bitflag)) in flag_map.items()])
+    """Moz API result code to attribute name map, derived from flag_map"""
 
     def store_result(self, rd):
         """
@@ -111,14 +177,33 @@ class URLMetrics(models.Model):
           rd (dict): The JSON result in dictionary form.
         """
         for k,v in rd.items():
-            for fk, fv in URLMetrics.flag_map.items():
-                if fv[0] == k:
-                    # print k, v, fk, fv
-                    attr = fk.lower().replace(' ', '_')
-                    # print attr
-                    # val = 0 if val '0' else val
-                    setattr(self, attr, v)
-                    break
+            attr = URLMetrics.result_attrs.get(k)
+            if attr is not None:
+                setattr(self, attr, v)
+
+    @classmethod
+    def store_results(cls, metrics, results, last_updated):
+        """
+        Stores the results of a batch Moz API call for many URL metrics.  Only the fields returned for each URL (and the update time) are written, and URLs with identical values (e.g. no data) are saved together, with one UPDATE query per distinct set of values.
+
+        Args:
+          metrics (list): The URLMetrics objects that were checked.
+          results (list): The JSON results in dictionary form, in the same order as metrics.
+          last_updated (datetime): Date/time the URLs were checked.
+        """
+        if len(metrics) == 0:
+            return
+        fields = set([f.attname for f in cls._meta.fields])
+        groups = collections.defaultdict(list)
+        for (m, rd) in zip(metrics, results):
+            m.store_result(rd)
+            m.last_updated = last_updated
+            # Only known result fields are written (see result_attrs)
+            attrs = set([URLMetrics.result_attrs[k] for k in rd.keys() if URLMetrics.result_attrs.get(k) in fields])
+            attrs.add(u'last_updated')
+            groups[frozenset([(attr, getattr(m, attr)) for attr in attrs])].append(m.id)
+        for (values, ids) in groups.items():
+            URLMetrics.objects.filter(id__in=ids).update(**dict(values))
 
     def is_uptodate(self):
         """
@@ -126,8 +211,46 @@ class URLMetrics(models.Model):
         """
         if self.last_updated is None:
             return False
-        last_moz_update = MozLastUpdate.get_most_recent()
-        return last_moz_update < self.last_updated
+        last_moz_update = MozLastUpdate.get_latest()
+        return last_moz_update is not None and last_moz_update < self.last_updated
+
+    @classmethod
+    def get_stale_filter(cls, prefix=u''):
+        """
+        Returns a query filter that selects the URL metrics that are not up-to-date (see URLMetrics.is_uptodate).
+
+        Args:
+          prefix (str): Lookup prefix if filtering a related model (e.g. 'urlmetrics__').
+        """
+        last_moz_update = MozLastUpdate.get_latest()
+        if last_moz_update is None:
+            return Q()
+        return Q(**{prefix+'last_updated__isnull' : True}) | Q(**{prefix+'last_updated__lte' : last_moz_update})
+
+    @classmethod
+    def get_key(cls, query_url):
+        """
+        Returns the normalized (lower case) form of a query URL, under which its URLMetrics are stored.  Domain names are case-insensitive, and so is the default MySQL collation of query_url, so records are always matched by this key rather than by the raw string.
+        """
+        return query_url.strip().lower()
+
+    @classmethod
+    def get_or_create_all(cls, query_urls):
+        """
+        Returns the URLMetrics for each of the given query URLs as a dictionary keyed by query URL (as given).  Any that do not exist yet are created in bulk.  This is safe to call concurrently, even within a transaction: records created by another process in the meantime are fetched rather than duplicated.
+
+        Args:
+          query_urls (iterable): The query URLs to retrieve.
+        """
+        keys = dict([(query_url, URLMetrics.get_key(query_url)) for query_url in set(query_urls)])
+        wanted = set(keys.values())
+        found = dict([(URLMetrics.get_key(um.query_url), um) for um in URLMetrics.objects.filter(query_url__in=wanted)])
+        missing = wanted.difference(found.keys())
+        if len(missing) > 0:
+            URLMetrics._bulk_create_race_safe([URLMetrics(query_url=key) for key in sorted(missing)])
+            # Records created in bulk have no ID yet (and conflicting ones were created elsewhere), so all are read back
+            found.update([(URLMetrics.get_key(um.query_url), um) for um in URLMetrics._filter_latest(query_url__in=missing)])
+        return dict([(query_url, found[key]) for (query_url, key) in keys.items()])
 
     @classmethod
     def create_cols_bitflag(cls, cols):
@@ -143,11 +266,99 @@ class URLMetrics(models.Model):
         return bf
 
 
+class CacheVersion(RaceSafeMixin, models.Model):
+    """
+    A counter that is incremented whenever a set of data cached in-process (e.g. the TLD index) changes, allowing every process to detect that its copy is stale.
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    """Name of the cached data set"""
+    version = models.IntegerField(default=0)
+    """Current version of the data set"""
+
+    @classmethod
+    def get_version(cls, key):
+        """
+        Returns the current version for the given key (0 if the data set has never been changed).
+        """
+        try:
+            return CacheVersion.objects.get(key=key).version
+        except CacheVersion.DoesNotExist:
+            return 0
+
+    @classmethod
+    def bump(cls, key):
+        """
+        Increments the version for the given key, invalidating all in-process copies of the data set.
+        """
+        CacheVersion._update_or_create_race_safe({'key' : key}, {'version' : models.F('version')+1}, {'version' : 1})
+
+TLDInfo = collections.namedtuple('TLDInfo', ['domain', 'is_recognized', 'is_api_registerable', 'type'])
+"""In-memory copy of the attributes of a single TLD record"""
+
+class TLDIndex(object):
+    """
+    Compiled public suffix index of the TLD table.  Suffix rules are stored in a trie keyed by reversed domain labels, so matching a domain costs one dictionary lookup per label rather than a scan of the full TLD list.  Exception (!) and wildcard (*) rules are supported.  Each rule carries a TLDInfo, so no database access is needed once the index is built.
+    """
+    RULE = 0
+    """Trie node key holding a normal suffix rule"""
+    EXCEPTION = 1
+    """Trie node key holding an exception rule"""
+
+    def __init__(self, rules):
+        """
+        Args:
+          rules (iterable): TLDInfo for each suffix rule, with the domain in public suffix list format (e.g. co.uk, *.ar, !educ.ar).
+        """
+        self.root = {}
+        self.size = 0
+        for info in rules:
+            rule = info.domain
+            key = TLDIndex.RULE
+            labels = rule
+            if rule.startswith(u'!'):
+                key = TLDIndex.EXCEPTION
+                labels = rule[1:]
+            node = self.root
+            for label in reversed(labels.split(u'.')):
+                node = node.setdefault(label, {})
+            node[key] = info
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def match(self, labels, use_wildcards=False):
+        """
+        Finds the longest suffix rule that matches the given domain labels.
+
+        Args:
+          labels (list): Domain name split into labels, e.g. ['www', 'example', 'co', 'uk'].
+          use_wildcards (bool): Whether wildcard rules (e.g. *.ar) should be considered.
+
+        Returns:
+          A tuple of the matched rule's TLDInfo and the number of trailing labels it covers, or None if no rule matches.  An exception rule covers the registrable domain itself rather than a suffix.
+        """
+        node = self.root
+        result = None
+        depth = 0
+        for label in reversed(labels):
+            if use_wildcards and u'*' in node and TLDIndex.RULE in node[u'*']:
+                result = (node[u'*'][TLDIndex.RULE], depth+1, False)
+            node = node.get(label)
+            if node is None:
+                break
+            depth += 1
+            if TLDIndex.EXCEPTION in node:
+                result = (node[TLDIndex.EXCEPTION], depth, True)
+            elif TLDIndex.RULE in node:
+                result = (node[TLDIndex.RULE], depth, False)
+        return result
+
 class TLD(models.Model):
     """
     A top-level domain.
     """
-    domain = models.CharField(max_length=50)
+    domain = models.CharField(max_length=50, db_index=True)
     """Domain name"""
     is_recognized = models.BooleanField(default=False)
     """Whether the domain is recognized by the Namecheap API"""
@@ -158,6 +369,31 @@ class TLD(models.Model):
     type = models.CharField(max_length=50)
     """Type of the domain, as listed by the Namecheap API"""
 
+    CACHE_KEY = u'tld'
+    """CacheVersion key for the TLD table"""
+    _index = None
+    _index_version = None
+
+    @classmethod
+    def get_index(cls):
+        """
+        Returns the compiled TLDIndex for the TLD table.  The index is built once per process and only rebuilt when the table has been changed (see TLD.changed).
+        """
+        version = CacheVersion.get_version(TLD.CACHE_KEY)
+        if TLD._index is None or TLD._index_version != version:
+            # Recognized records are loaded last so that they take precedence over any duplicates
+            rows = TLD.objects.order_by('is_recognized', 'is_api_registerable').values_list('domain', 'is_recognized', 'is_api_registerable', 'type')
+            TLD._index = TLDIndex([TLDInfo(unicode(d), r, a, t) for (d, r, a, t) in rows])
+            TLD._index_version = version
+        return TLD._index
+
+    @classmethod
+    def changed(cls):
+        """
+        Marks the TLD table as changed, so that all processes rebuild their index on next use.
+        """
+        CacheVersion.bump(TLD.CACHE_KEY)
+
 class ExcludedDomain(models.Model):
     """
     Top-level domain that should be automatically excluded (e.g. common domains like facebook.com, google.com)
@@ -179,6 +415,30 @@ class ExtensionPrefix(models.Model):
     prefix = models.CharField(max_length=MAX_DOMAIN_LENGTH)
     """Prefix string (omitting the trailing period)"""
 
+    CACHE_KEY = u'extensionprefix'
+    """CacheVersion key for the extension prefix table"""
+    _prefixes = None
+    _prefixes_version = None
+
+    @classmethod
+    def get_prefixes(cls):
+        """
+        Returns the list of extension prefix strings.  The list is loaded once per process and only reloaded when the prefixes have been changed (see ExtensionPrefix.changed).
+        """
+        version = CacheVersion.get_version(ExtensionPrefix.CACHE_KEY)
+        if ExtensionPrefix._prefixes is None or ExtensionPrefix._prefixes_version != version:
+            ExtensionPrefix._prefixes = [unicode(prefix) for prefix in ExtensionPrefix.objects.values_list('prefix', flat=True)]
+            ExtensionPrefix._prefixes_version = version
+        return ExtensionPrefix._prefixes
+
+    @classmethod
+    def changed(cls):
+        """
+        Marks the extension prefixes as changed, so that all processes reload them on next use.
+        """
+        CacheVersion.bump(ExtensionPrefix.CACHE_KEY)
+        ExtensionPrefix._prefixes = None
+
 class UserProject(models.Model):
     """
     A project uploaded by a user.
@@ -191,6 +451,10 @@ class UserProject(models.Model):
         (u'completed', u'Completed'),
         (u'error', u'Error'))
     """Enumeration of recognized project states"""
+    STATE_WORK = {
+        u'checking' : u'checker',
+        u'measuring' : u'metrics'}
+    """Type of work (see PendingWork) that progresses a project in each working state"""
     user = models.ForeignKey(User)
     """The user that uploaded this project"""
     created = models.DateTimeField(auto_now_add=True)
@@ -201,6 +465,10 @@ class UserProject(models.Model):
     """If the project encountered a fatal error, this field contains a text description of the error"""
     parse_errors = models.TextField(blank=True, null=True, default=None)
     """An aggregated list of errors encountered when parsing (non-fatal)"""
+    lines_total = models.IntegerField(default=0)
+    """Number of lines in the uploaded file"""
+    lines_parsed = models.IntegerField(default=0)
+    """Number of lines of the uploaded file parsed so far"""
     creation_datetime = models.DateTimeField(blank=True, auto_now_add=True)
     """Date/time the project was created"""
     completed_datetime = models.DateTimeField(blank=True, null=True)
@@ -212,6 +480,10 @@ class UserProject(models.Model):
     urlmetrics = models.ManyToManyField(URLMetrics, through='ProjectMetrics')
     """Association with available URL metrics"""
 
+    class Meta:
+        # The project listing pages through a user's projects by creation date
+        index_together = [['user', 'created', 'id']]
+
     def name(self):
         """
         Returns the name of the project (currently the filename of the uploaded file).
@@ -229,6 +501,15 @@ class UserProject(models.Model):
                       u'Thank you for using Domain Checker.') % (self.name(), server_address, self.id)
         send_mail(u'Domain Checker - Project "%s" complete' % (self.name()), messagebody, reply_address, [self.user.email])
 
+    def get_counts(self):
+        """
+        Returns the denormalised domain and metrics counts of this project (see ProjectCounts), or zero counts if none have been recorded yet.
+        """
+        try:
+            return self.counts
+        except ProjectCounts.DoesNotExist:
+            return ProjectCounts(project=self)
+
     def get_measurable_domains(self):
         """
         Returns the number of associations with URL metrics.
@@ -245,22 +526,23 @@ class UserProject(models.Model):
         """
         Returns a float percentage estimate of the project progress based on how many domains have been checked for availability and/or measured.
         """
-        checkable_domains = len(self.projectdomain_set.all())
-        checked_domains = len(self.projectdomain_set.filter(is_checked=True))
-
-        measurable_domains = len(self.get_measurable_domains())
-        measured_domains = len(self.get_measured_domains())
-
-        completed_domains = checked_domains + measured_domains
-        total_domains = checkable_domains + measurable_domains
+        counts = self.get_counts()
+        completed_domains = counts.domains_checked + counts.metrics_checked
+        total_domains = counts.domains_total + counts.metrics_total
 
         return 100.0 if total_domains == 0 else (completed_domains*100.0) / total_domains
 
+    def get_parse_percent_complete(self):
+        """
+        Returns a float percentage of the uploaded file lines parsed so far.
+        """
+        return 100.0 if self.lines_total == 0 else (self.lines_parsed*100.0) / self.lines_total
+
     def get_percent_complete_display(self):
         """
         Returns the project completion estimate in string form with two decimal places.
         """
-        return '%.2f' % self.get_percent_complete
+        return '%.2f' % self.get_percent_complete()
 
     def is_running(self):
         """
@@ -272,18 +554,22 @@ class UserProject(models.Model):
         """
         Returns whether all this project's domains have been availability checked.
         """
-        return self.projectdomain_set.filter(is_checked=False).count() == 0
+        return not self.projectdomain_set.filter(is_checked=False).exists()
 
     def all_measured(self):
         """
         Returns whether all applicable domains for this project have had their metrics collected.
         """
-        return self.projectmetrics_set.filter(is_checked=False).count() == 0
+        return not self.projectmetrics_set.filter(is_checked=False).exists()
 
     def update_state(self, save=True):
         """
-        Sets the project state according to how many domains have been availability checked and/or metric measured (also takes into account errors.
+        Sets the project state according to how many domains have been availability checked and/or metric measured (also takes into account errors.  When the project moves into a working state, the matching work is scheduled as due straight away, so that it is started by the next check_project_tasks run even if the caller does not start it.
+
+        Returns:
+          The type of work scheduled (see STATE_WORK), or None if the state did not change to a working state.
         """
+        scheduled = None
         with transaction.atomic():
             if self.state not in ['paused', 'error', 'parsing']:
                 if not self.all_checked():
@@ -299,9 +585,13 @@ class UserProject(models.Model):
                         self.send_completion_email()
                         self.completion_email_sent = True
                         self.completed_datetime = timezone.now()
+                    elif new_state in UserProject.STATE_WORK:
+                        scheduled = UserProject.STATE_WORK[new_state]
+                        PendingWork.schedule(self, scheduled, timezone.now())
                 self.state = new_state
                 if save:
                     self.save()
+        return scheduled
 
     def run_time(self):
         """
@@ -326,6 +616,12 @@ class ProjectMetrics(models.Model):
     """Whether the URL metric has been updated/checked for this particular project"""
     is_extension = models.BooleanField(default=False)
     """Whether this association represents an 'extension', i.e. the addition of 'www.' to an existing URL metric"""
+    error = models.TextField(blank=True, null=True, default=None)
+    """If the URL metric could not be retrieved, a text description of the error"""
+
+    class Meta:
+        # Measurers select a project's unchecked metrics
+        index_together = [['project', 'is_checked']]
     
 class UploadedFile(models.Model):
     """
@@ -335,8 +631,19 @@ class UploadedFile(models.Model):
     """The project for which the file was uploaded"""
     filename = models.CharField(max_length=255)
     """File's name"""
-    filedata = models.TextField()
-    """The contents of the file, stored as raw text"""
+    datafile = models.FileField(upload_to=u'uploads', null=True, blank=True, default=None)
+    """The uploaded file, kept in the media storage so it is written and read in chunks"""
+    filedata = models.TextField(blank=True, default=u'')
+    """The contents of files uploaded before datafile was introduced, stored as raw text"""
+
+    def open_data(self):
+        """
+        Returns the contents of the file as a file-like object of unicode text (undecodable bytes are dropped), to be read in chunks.
+        """
+        if not self.datafile:
+            return io.StringIO(self.filedata)
+        self.datafile.open('rb')
+        return codecs.getreader('utf-8')(self.datafile, errors='ignore')
 
 class ProjectDomain(models.Model):
     """
@@ -367,14 +674,93 @@ class ProjectDomain(models.Model):
     last_checked = models.DateTimeField()
     """Date/time the domain was checked"""
 
-class ProjectTask(models.Model):
+    class Meta:
+        # Checkers select a project's unchecked domains, and the project view pages through them by state and name
+        index_together = [['project', 'is_checked'], ['project', 'state', 'domain']]
+
+class ProjectCounts(RaceSafeMixin, models.Model):
     """
-    A background(Celery) task for a project.
+    Denormalised counts of a project's domains (in total, checked and by state) and metrics associations (in total and measured).  The counts are adjusted in the same transaction as each batch of results is saved, so that progress is read without counting rows.  If they drift (e.g. after rows are changed by hand), they can be rebuilt by recount (see the recountprojects command).
+    """
+    project = models.OneToOneField(UserProject, primary_key=True, related_name='counts')
+    """The project"""
+    domains_total = models.IntegerField(default=0)
+    """Number of project domains"""
+    domains_checked = models.IntegerField(default=0)
+    """Number of project domains that have been checked (or need no check)"""
+    domains_unchecked = models.IntegerField(default=0)
+    """Number of project domains in the 'unchecked' state"""
+    domains_unregisterable = models.IntegerField(default=0)
+    """Number of project domains in the 'unregisterable' state"""
+    domains_available = models.IntegerField(default=0)
+    """Number of project domains in the 'available' state"""
+    domains_unavailable = models.IntegerField(default=0)
+    """Number of project domains in the 'unavailable' state"""
+    domains_special = models.IntegerField(default=0)
+    """Number of project domains in the 'special' state"""
+    domains_error = models.IntegerField(default=0)
+    """Number of project domains in the 'error' state"""
+    metrics_total = models.IntegerField(default=0)
+    """Number of metrics associations (i.e. measurable domains)"""
+    metrics_checked = models.IntegerField(default=0)
+    """Number of metrics associations that have been measured"""
 
-    .. note::
-      
-      This was intended for internal tracking of celery tasks, but is not currently used.
+    def get_checkable(self):
+        """
+        Returns the number of domains that are (or are to be) checked for availability.
+        """
+        return self.domains_unchecked + self.domains_available + self.domains_unavailable
+
+    @classmethod
+    def adjust(cls, project, **deltas):
+        """
+        Adds the given amounts to the named counts of a project (e.g. domains_checked=10) in a single query, so that concurrent adjustments are never lost.  This should be called in the same transaction as the changes counted.
+
+        Args:
+          project (UserProject): The project to adjust the counts of.
+        """
+        deltas = dict([(field, delta) for (field, delta) in deltas.items() if delta != 0])
+        if len(deltas) == 0:
+            return
+        ProjectCounts._update_or_create_race_safe({'project' : project}, dict([(field, F(field) + delta) for (field, delta) in deltas.items()]), deltas)
+
+    @classmethod
+    def add_domains(cls, project, states):
+        """
+        Counts newly created project domains.
+
+        Args:
+          project (UserProject): The project the domains belong to.
+          states (list): The state of each new domain (one of ProjectDomain.DOMAIN_STATES).
+        """
+        deltas = {u'domains_total' : len(states), u'domains_checked' : len([s for s in states if s != u'unchecked'])}
+        for state in states:
+            deltas[u'domains_' + state] = deltas.get(u'domains_' + state, 0) + 1
+        ProjectCounts.adjust(project, **deltas)
+
+    @classmethod
+    def recount(cls, project):
+        """
+        Rebuilds the counts of a project from its domains and metrics associations.  Adjustments made while the recount is in progress may be lost, so this is best done while the project is not running.
+
+        Returns:
+          The rebuilt ProjectCounts.
+        """
+        counts = ProjectCounts(project=project)
+        for row in ProjectDomain.objects.filter(project=project).values('state').annotate(n=Count('id')).order_by():
+            setattr(counts, u'domains_' + row['state'], row['n'])
+            counts.domains_total += row['n']
+        counts.domains_checked = ProjectDomain.objects.filter(project=project, is_checked=True).count()
+        for row in ProjectMetrics.objects.filter(project=project).values('is_checked').annotate(n=Count('id')).order_by():
+            if row['is_checked']:
+                counts.metrics_checked = row['n']
+            counts.metrics_total += row['n']
+        counts.save()
+        return counts
 
+class ProjectTask(models.Model):
+    """
+    A background (Celery) task for a project, which doubles as its heartbeat record.  The task holds the record for a limited time (see expires) and extends it as it progresses, so whether any task is alive for a project is answered by a single indexed query rather than by inspecting the workers.  The record is removed once the task finishes.
     """
     PROJ_TASK_TYPES = (
         ('parser', 'Parser'), # Parsing domains from file data
@@ -383,10 +769,105 @@ class ProjectTask(models.Model):
     """Enumeration of project types"""
     project = models.ForeignKey(UserProject)
     """The project"""
-    celery_id = models.CharField(max_length=255)
+    celery_id = models.CharField(max_length=255, db_index=True)
     """The Celery ID of the task"""
     type = models.CharField(max_length=20, choices=PROJ_TASK_TYPES)
     """The type of task, one of PROJ_TASK_TYPES"""
+    expires = models.DateTimeField(null=True, blank=True, default=None)
+    """Date/time after which the task is presumed lost unless it sends another heartbeat"""
+
+    class Meta:
+        # Liveness checks select a project's unexpired tasks
+        index_together = [['project', 'expires']]
+
+    @classmethod
+    def heartbeat(cls, celery_id, duration):
+        """
+        Extends the record of a running task.  This should be called regularly by the task (at least once within each duration).
+
+        Args:
+          celery_id (str): The Celery ID of the task, or None if the task is not running through Celery (e.g. called directly).
+          duration (float): Number of seconds the task is presumed alive for.
+        """
+        if celery_id is not None:
+            ProjectTask.objects.filter(celery_id=celery_id).update(expires=timezone.now() + datetime.timedelta(seconds=duration))
+
+    @classmethod
+    def finish(cls, celery_id):
+        """
+        Removes the record of a task once it has finished.
+        """
+        if celery_id is not None:
+            ProjectTask.objects.filter(celery_id=celery_id).delete()
+
+    @classmethod
+    def get_live(cls, project_ids, now=None):
+        """
+        Returns the set of (project ID, task type) of the given projects that have a live task.
+
+        Args:
+          project_ids (list): The IDs of the projects to check.
+          now (datetime): The current date/time.
+        """
+        if now is None:
+            now = timezone.now()
+        return set(ProjectTask.objects.filter(project_id__in=project_ids, expires__gt=now).values_list('project_id', 'type'))
+
+class PendingWork(RaceSafeMixin, models.Model):
+    """
+    A stage of work (e.g. checking domains) that has been scheduled for a project but not yet completed.  Each stage schedules the next one directly when it finishes, so this table only has to be polled (by due time) to recover work whose task has been lost, e.g. if the server was reset.
+    """
+    project = models.ForeignKey(UserProject)
+    """The project"""
+    type = models.CharField(max_length=20, choices=ProjectTask.PROJ_TASK_TYPES)
+    """The type of task that performs the work, one of ProjectTask.PROJ_TASK_TYPES"""
+    due = models.DateTimeField(db_index=True)
+    """Date/time after which the work is overdue (and should be checked on) if still pending"""
+    failures = models.IntegerField(default=0)
+    """Number of consecutive failed attempts at the work (see PendingWork.fail)"""
+
+    class Meta:
+        unique_together = [['project', 'type']]
+
+    @classmethod
+    def schedule(cls, project, task_type, due):
+        """
+        Records the given work as pending (or moves its due time if already pending).
+
+        Args:
+          project (UserProject): The project the work is for.
+          task_type (str): The type of task that performs the work, one of ProjectTask.PROJ_TASK_TYPES.
+          due (datetime): Date/time after which the work is overdue.
+        """
+        PendingWork._update_or_create_race_safe({'project' : project, 'type' : task_type}, {'due' : due}, {'due' : due})
+
+    @classmethod
+    def fail(cls, project, task_type):
+        """
+        Counts a failed attempt at the given work (recording the work as pending if it is not already).
+
+        Returns:
+          The number of consecutive failed attempts, including this one.
+        """
+        PendingWork._update_or_create_race_safe({'project' : project, 'type' : task_type}, {'failures' : models.F('failures')+1}, {'due' : timezone.now(), 'failures' : 1})
+        return PendingWork.objects.get(project=project, type=task_type).failures
+
+    @classmethod
+    def succeed(cls, project, task_type):
+        """
+        Resets the count of consecutive failed attempts at the given work once an attempt has succeeded.
+        """
+        PendingWork.objects.filter(project=project, type=task_type, failures__gt=0).update(failures=0)
+
+    @classmethod
+    def done(cls, project, task_type=None):
+        """
+        Removes the given work (or all work for the project if no type is given) once it has been completed.
+        """
+        pending = PendingWork.objects.filter(project=project)
+        if task_type is not None:
+            pending = pending.filter(type=task_type)
+        pending.delete()
 
 # A single administrator-changeable settings
 class AdminSetting(models.Model):
@@ -406,20 +887,64 @@ class AdminSetting(models.Model):
     choices = models.TextField(blank=True, null=True, default=None)
     """If of the 'choice' data type, a comma-separated list of possible choices"""
 
+    CACHE_KEY = u'adminsetting'
+    """CacheVersion key for the settings table"""
+    VERSION_CHECK_INTERVAL = 5.0
+    """Minimum number of seconds between checks of whether the settings have changed in another process"""
+    _values = None
+    _values_version = None
+    _values_checked = 0.0
+
+    def get_typed_value(self):
+        """
+        Returns the value of this setting as the correct data type.
+        """
+        if self.type == 'integer':
+            return int(self.value)
+        elif self.type == 'boolean':
+            return True if self.value == 'true' else False
+        elif self.type == 'float':
+            return float(self.value)
+        else:
+            return self.value
+
+    @classmethod
+    def get_values(cls):
+        """
+        Returns a dictionary of all settings keyed by setting key.  The settings are loaded in one query and kept in-process until they are changed (see AdminSetting.changed), so repeated lookups do not touch the database.
+        """
+        now = time.time()
+        if AdminSetting._values is None or now - AdminSetting._values_checked >= AdminSetting.VERSION_CHECK_INTERVAL:
+            version = CacheVersion.get_version(AdminSetting.CACHE_KEY)
+            if AdminSetting._values is None or AdminSetting._values_version != version:
+                AdminSetting._values = dict([(ads.key, ads) for ads in AdminSetting.objects.all()])
+                AdminSetting._values_version = version
+            AdminSetting._values_checked = now
+        return AdminSetting._values
+
+    @classmethod
+    def changed(cls):
+        """
+        Marks the settings as changed, so that all processes reload them on next use.
+        """
+        CacheVersion.bump(AdminSetting.CACHE_KEY)
+        AdminSetting._values = None
+
     @classmethod
-    def get_value(cls, key):
+    def get_value(cls, key, default=None):
         """
         Returns the value for the given key as the corrent data type.
+
+        Args:
+          key (str): The setting key.
+          default: Value returned if the setting does not exist (e.g. it was added after the static data was imported).  If not given, a missing setting raises AdminSetting.DoesNotExist.
         """
-        ads = AdminSetting.objects.get(key=key)
-        if ads.type == 'integer':
-            return int(ads.value)
-        elif ads.type == 'boolean':
-            return True if ads.value == 'true' else False
-        elif ads.type == 'float':
-            return float(ads.value)
-        else:
-            return ads.value
+        values = cls.get_values()
+        if key not in values:
+            if default is None:
+                raise AdminSetting.DoesNotExist(u'Setting "%s" does not exist' % key)
+            return default
+        return values[key].get_typed_value()
 
     @classmethod
     def generate_moz_signature(cls, access_id, expires, key):
@@ -449,7 +974,30 @@ class AdminSetting(models.Model):
         Returns the set Moz API call wait interval (i.e. live or test).
         """
         prefix = 'live_' if cls.get_value('use_live_moz_api') else 'test_'
-        return cls.get_value(prefix+'moz_api_wait_time')
+        return cls.get_value(prefix+'moz_api_wait_time', 21)
+
+    @classmethod
+    def get_moz_api_rate_limit(cls):
+        """
+        Returns the set Moz API rate limit (i.e. live or test) in requests per second, derived from the wait interval.  Returns None if calls are not limited (a wait interval of 0).
+        """
+        wait_time = cls.get_moz_api_wait_time()
+        return 1.0 / wait_time if wait_time > 0 else None
+
+    @classmethod
+    def get_moz_api_batch_size(cls):
+        """
+        Returns the set maximum number of URLs in a single Moz API call (i.e. live or test).
+        """
+        prefix = 'live_' if cls.get_value('use_live_moz_api') else 'test_'
+        return max(cls.get_value(prefix+'moz_api_batch_size', 10), 1)
+
+    @classmethod
+    def get_availability_cache_ttl(cls):
+        """
+        Returns the number of seconds a domain availability result is reused for by other checks (0 if results are not reused, see DomainAvailability).
+        """
+        return max(cls.get_value('availability_cache_ttl', 24.0), 0)*60*60
 
     @classmethod
     def get_moz_params(cls):
@@ -504,6 +1052,32 @@ class AdminSetting(models.Model):
         else:
             return AdminSetting.get_value('sandbox_api_wait_time')
 
+    @classmethod
+    def get_api_rate_limit(cls):
+        """
+        Returns the currently set Namecheap API rate limit (i.e. live or test) as a tuple of the sustained rate in requests per second and the burst size.  If no rate has been set, one call per wait interval is allowed.
+        """
+        prefix = 'live_' if AdminSetting.get_value('use_live_api') else 'sandbox_'
+        rate = AdminSetting.get_value(prefix+'api_rate_limit', 0.0)
+        if rate <= 0.0:
+            rate = 1.0 / max(AdminSetting.get_api_wait_time(), 1)
+        burst = max(AdminSetting.get_value(prefix+'api_burst', 1), 1)
+        return (rate, burst)
+
+    @classmethod
+    def get_api_requests_in_flight(cls):
+        """
+        Returns the set maximum number of Namecheap API calls made concurrently by a single check.
+        """
+        return max(AdminSetting.get_value('api_requests_in_flight', 2), 1)
+
+    @classmethod
+    def get_domain_batch_size(cls):
+        """
+        Returns the set number of project domains saved (or checked) per transaction.
+        """
+        return max(AdminSetting.get_value('domain_batch_size', 1000), 1)
+
     @classmethod
     def get_api_urls_per_request(cls):
         """
@@ -514,21 +1088,254 @@ class AdminSetting(models.Model):
         else:
             return AdminSetting.get_value('sandbox_api_urls_per_request')
 
+class TokenBucket(RaceSafeMixin, models.Model):
+    """
+    A token bucket rate limiter whose state is shared by all processes (and hosts) through the database, used to keep calls to an external API within its quota.  Tokens are added continuously at the set rate up to the burst size, and each call consumes one token.
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    """Name of the rate limited resource"""
+    tokens = models.FloatField(default=0.0)
+    """Number of tokens available at the time of the last update"""
+    updated = models.FloatField(default=0.0)
+    """UNIX time of the last update"""
+
+    @classmethod
+    def try_acquire(cls, key, rate, burst):
+        """
+        Attempts to take a token from the bucket with the given key.
+
+        Args:
+          key (str): Name of the rate limited resource.
+          rate (float): Number of tokens added per second.
+          burst (int): Maximum number of tokens the bucket holds.
+
+        Returns:
+          0 if a token was taken, otherwise the number of seconds until a token will be available.
+        """
+        TokenBucket._get_or_create_race_safe(key=key, defaults={'tokens' : float(burst), 'updated' : time.time()})
+        with transaction.atomic():
+            bucket = TokenBucket.objects.select_for_update().get(key=key)
+            now = time.time()
+            bucket.tokens = min(float(burst), bucket.tokens + max(0.0, now - bucket.updated) * rate)
+            bucket.updated = now
+            if bucket.tokens >= 1.0:
+                bucket.tokens -= 1.0
+                wait = 0
+            else:
+                wait = (1.0 - bucket.tokens) / rate
+            bucket.save()
+        return wait
+
+    @classmethod
+    def acquire(cls, key, rate, burst):
+        """
+        Takes a token from the bucket with the given key, sleeping until one is available if necessary.  No lock is held while sleeping.
+
+        Args:
+          key (str): Name of the rate limited resource.
+          rate (float): Number of tokens added per second.
+          burst (int): Maximum number of tokens the bucket holds.
+        """
+        while True:
+            wait = cls.try_acquire(key, rate, burst)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+class Lease(RaceSafeMixin, models.Model):
+    """
+    A lock on a shared resource that is held for a limited time, shared by all processes (and hosts) through the database.  A holder that crashes or stalls loses the lease once it expires, and every new holder is issued a higher fencing token so that writes made under an earlier (lost) lease can be rejected.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    """Name of the locked resource"""
+    owner = models.CharField(max_length=100, blank=True, default=u'')
+    """Identifier of the current holder (blank if released)"""
+    expires = models.FloatField(default=0.0)
+    """UNIX time at which the lease expires"""
+    token = models.IntegerField(default=0)
+    """Fencing token of the current holder, incremented each time the lease changes hands"""
+
+    @classmethod
+    def try_acquire(cls, key, owner, duration):
+        """
+        Attempts to take the lease with the given key.  The lease is granted if it is free, has expired or is already held by the given owner (in which case it is extended).
+
+        Args:
+          key (str): Name of the locked resource.
+          owner (str): Identifier of the process requesting the lease.
+          duration (float): Number of seconds the lease is held for unless renewed.
+
+        Returns:
+          The fencing token of the lease if it was granted, otherwise None.
+        """
+        Lease._get_or_create_race_safe(key=key)
+        with transaction.atomic():
+            lease = Lease.objects.select_for_update().get(key=key)
+            now = time.time()
+            if lease.owner != owner:
+                if len(lease.owner) > 0 and lease.expires > now:
+                    return None
+                lease.owner = owner
+                lease.token += 1
+            lease.expires = now + duration
+            lease.save()
+            return lease.token
+
+    @classmethod
+    def renew(cls, key, owner, token, duration):
+        """
+        Extends a held lease.  Returns whether the lease is still held (i.e. has not been taken over by another process since it was granted).
+        """
+        return Lease.objects.filter(key=key, owner=owner, token=token).update(expires=time.time()+duration) > 0
+
+    @classmethod
+    def release(cls, key, owner, token):
+        """
+        Releases a held lease (does nothing if it has since been taken over by another process).
+        """
+        Lease.objects.filter(key=key, owner=owner, token=token).update(owner=u'', expires=0.0)
+
+    @classmethod
+    def is_held(cls, key, owner, token):
+        """
+        Returns whether the given lease is still held and unexpired.  When called inside a transaction the lease row stays locked until the transaction ends, so the lease cannot change hands while the caller writes under it.
+        """
+        return Lease.objects.select_for_update().filter(key=key, owner=owner, token=token, expires__gt=time.time()).exists()
+
 class MozLastUpdate(models.Model):
     """
     A record of a call the Moz API to check when the Moz data was last updated.  This is used to check whether existing URL metrics need to be updated.
     """
     datetime = models.DateTimeField()
-    retrieved = models.DateTimeField()
+    retrieved = models.DateTimeField(db_index=True)
+
+    CACHE_KEY = u'mozlastupdate'
+    """CacheVersion key for the Moz update records"""
+    VERSION_CHECK_INTERVAL = 60.0
+    """Minimum number of seconds between checks of whether a new update has been recorded by another process"""
+    _latest = None
+    _latest_version = None
+    _latest_checked = 0.0
+
+    @classmethod
+    def get_latest(cls):
+        """
+        Returns the date/time of the most recent update, or None if no update has been recorded.  The value is kept in-process until a new update is recorded (see MozLastUpdate.changed), so staleness checks do not touch the database.
+        """
+        now = time.time()
+        if now - MozLastUpdate._latest_checked >= MozLastUpdate.VERSION_CHECK_INTERVAL:
+            version = CacheVersion.get_version(MozLastUpdate.CACHE_KEY)
+            if MozLastUpdate._latest_version != version:
+                latest = list(MozLastUpdate.objects.order_by('-retrieved').values_list('datetime', flat=True)[:1])
+                MozLastUpdate._latest = latest[0] if len(latest) > 0 else None
+                MozLastUpdate._latest_version = version
+            MozLastUpdate._latest_checked = now
+        return MozLastUpdate._latest
 
     @classmethod
     def get_most_recent(cls):
         """
-        Returns the date/time of the most recent update.
+        Returns the date/time of the most recent update (the current time if no update has been recorded).
         """
-        mr = MozLastUpdate.objects.all().order_by('-retrieved')
-        if len(mr) == 0:
+        latest = cls.get_latest()
+        if latest is None:
             return timezone.now()
         else:
-            return mr[0].datetime
+            return latest
+
+    @classmethod
+    def changed(cls):
+        """
+        Marks the update records as changed, so that all processes reload the most recent update on next use.
+        """
+        CacheVersion.bump(MozLastUpdate.CACHE_KEY)
+        MozLastUpdate._latest_version = None
+        MozLastUpdate._latest_checked = 0.0
+
+class DomainAvailability(RaceSafeMixin, models.Model):
+    """
+    The most recent availability result of a domain, shared by all projects so that a domain checked for one project is not checked again with the Namecheap API for another while the result is still fresh (see AdminSetting.get_availability_cache_ttl).
+    """
+    domain = models.CharField(max_length=MAX_DOMAIN_LENGTH, unique=True)
+    """The normalized domain name (see main.parsing.normalize_domain)"""
+    available = models.BooleanField(default=False)
+    """Whether the domain was available"""
+    checked = models.DateTimeField()
+    """Date/time the domain was checked"""
+
+    @classmethod
+    def get_fresh(cls, domains, ttl):
+        """
+        Returns the availability of those of the given domains that have been checked within the given time.
+
+        Args:
+          domains (list): The normalized domain names to look up.
+          ttl (float): Number of seconds a result stays fresh.
+
+        Returns:
+          A dictionary of availability (True or False) keyed by domain name.
+        """
+        if len(domains) == 0 or ttl <= 0:
+            return {}
+        since = timezone.now() - datetime.timedelta(seconds=ttl)
+        return dict(DomainAvailability.objects.filter(domain__in=domains, checked__gte=since).values_list('domain', 'available'))
+
+    @classmethod
+    def store(cls, results, checked):
+        """
+        Records the given availability results, replacing any older results for the same domains.
+
+        Args:
+          results (dict): Availability (True or False) keyed by normalized domain name.
+          checked (datetime): Date/time the domains were checked.
+        """
+        if len(results) == 0:
+            return
+        for available in [True, False]:
+            domains = [domain for (domain, a) in results.items() if a == available]
+            if len(domains) > 0:
+                DomainAvailability.objects.filter(domain__in=domains).update(available=available, checked=checked)
+        existing = set(DomainAvailability.objects.filter(domain__in=results.keys()).values_list('domain', flat=True))
+        missing = [DomainAvailability(domain=domain, available=available, checked=checked) for (domain, available) in results.items() if domain not in existing]
+        # Results created concurrently by another process are replaced instead
+        for da in DomainAvailability._bulk_create_race_safe(missing):
+            DomainAvailability.objects.filter(domain=da.domain).update(available=da.available, checked=checked)
+
+class CacheStatistics(RaceSafeMixin, models.Model):
+    """
+    Running hit and miss totals of a cache shared by all processes (e.g. DomainAvailability), so that its effect (e.g. on an API budget) can be seen.
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    """Name of the cache"""
+    hits = models.BigIntegerField(default=0)
+    """Number of lookups answered by the cache"""
+    misses = models.BigIntegerField(default=0)
+    """Number of lookups not answered by the cache"""
+    since = models.DateTimeField(auto_now_add=True)
+    """Date/time the totals were started"""
+
+    def get_hit_rate(self):
+        """
+        Returns the percentage of lookups answered by the cache.
+        """
+        total = self.hits + self.misses
+        return 0.0 if total == 0 else (self.hits*100.0) / total
 
+    @classmethod
+    def record(cls, key, hits, misses):
+        """
+        Adds the given numbers of hits and misses to the totals of the given cache.
+        """
+        if hits == 0 and misses == 0:
+            return
+        CacheStatistics._update_or_create_race_safe({'key' : key}, {'hits' : F('hits') + hits, 'misses' : F('misses') + misses}, {'hits' : hits, 'misses' : misses})
+
+    @classmethod
+    def get(cls, key):
+        """
+        Returns the totals of the given cache (zero if nothing has been recorded).
+        """
+        try:
+            return CacheStatistics.objects.get(key=key)
+        except CacheStatistics.DoesNotExist:
+            return CacheStatistics(key=key)
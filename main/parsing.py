@@ -0,0 +1,164 @@
+"""
+Domain checker file parsing for the main module.
+
+.. moduleauthor:: Chris Davoren <cdavoren@gmail.com>
+"""
+from __future__ import absolute_import
+from main.models import TLD, ExcludedDomain, PreservedDomain
+
+import logging, re
+from urlparse import urlparse
+
+logger = logging.getLogger(__name__)
+"""Logger name for the parsing module"""
+schemecheck_re = re.compile(r'[^\.]*?//')
+"""Regular expression for checking whether a scheme has been specified for a URL"""
+iponly_re = re.compile(r'[^\.]*?//([0-9]{1,3}\.){3}[0-9]{1,3}[/$]')
+"""Regular expression for checking whether a URL is an IP (not a domain name)"""
+portend_re = re.compile(r'(.*?):[0-9]+$')
+"""Regular expression for checking if there is a port number in a URL"""
+
+READ_CHUNK_SIZE = 64*1024
+"""Number of characters read at a time from an uploaded file"""
+
+def load_tlds():
+    """
+    Returns the compiled index of recognized top-level domains (see TLDIndex).
+    """
+    return TLD.get_index()
+
+def load_exclusions():
+    """
+    Returns the stored set of domains that should be excluded from availability checking.
+    """
+    return set([unicode(exclusion.domain) for exclusion in ExcludedDomain.objects.all()])
+
+def load_preservations():
+    """
+    Returns the stored set of domains for which subdomains should be preserved.
+    """
+    return set([unicode(preservation.domain) for preservation in PreservedDomain.objects.all()])
+
+def remove_subdomains(url, tlds):
+    """
+    Takes a given URL and returns the corresponding top-level domain (along with its attributes).  Note that this code has been adapted from an answer on StackOverflow.
+
+    Args:
+      url (str): The url to find the TLD for.
+      tlds (TLDIndex): The compiled index of recognized TLD's.
+
+    Returns:
+      A tuple of the matched TLD (as a TLDInfo), the domain without subdomains and the full domain.
+
+    Raises:
+      ValueError: If the TLD of the URL is not recognized.
+    """
+    # Checks for presence of // before domain (required by urlparse).  If it does not exist, add it.
+    if schemecheck_re.match(url) == None:
+        url = u'//'+url
+
+    # Use URL to retrieve the full domain name (including subdomains), dropping any user information (e.g. of email addresses)
+    full_domain = urlparse(url, scheme='http')[1].rpartition(u'@')[2]
+
+    # Split the parsed domain into elements to recognise the portion that represents the TLD
+    url_elements = full_domain.split('.')
+    if len(url_elements) > 0:
+        pe = portend_re.match(url_elements[-1])
+        if pe is not None:
+            url_elements[-1] = pe.group(1)
+
+    # Find the longest matching suffix, e.g. for ["abcde","co","uk"] the match is "co.uk" (2 elements)
+    # The wildcard format plays havoc with the way NameCheap TLDs are processed, so wildcards are skipped
+    match = tlds.match(url_elements, use_wildcards=False)
+    if match is not None:
+        (tld, length, is_exception) = match
+        if is_exception:
+            return (tld, u".".join(url_elements[-length:]), full_domain)
+        else:
+            return (tld, u".".join(url_elements[-length-1:]), full_domain)
+
+    # The TLD of this URL is not recognised
+    logger.debug(url_elements)
+    raise ValueError(u"Invalid address or domain not in recognized list of TLDs")
+
+def normalize_domain(domain):
+    """
+    Returns the normalized (lower case, IDNA/punycode encoded) form of a domain name, so that the same domain written in different ways can be matched exactly.
+
+    Args:
+      domain (str): The domain name to normalize.
+    """
+    domain = domain.strip().rstrip(u'.').lower()
+    try:
+        return domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        # Not a valid IDN (e.g. an empty or over-long label), so compare the raw form
+        return domain
+
+def read_lines(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    Generator that reads a file-like object in chunks and yields it one line at a time (without line endings), so the content is never split into a full list of lines.
+
+    Args:
+      f (file): The file-like object to read.
+      chunk_size (int): Number of characters to read at a time.
+    """
+    remainder = u''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(u'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    yield remainder
+
+def extract_domains(lines, start_line=0, seen=None):
+    """
+    Generator that parses the lines of an uploaded file, yielding a result for every new project domain found and for every line that could not be parsed.  Duplicate domains are only reported once.
+
+    Args:
+      lines (iterable): The lines of the file.
+      start_line (int): Number of lines to skip (e.g. already parsed before a restart).
+      seen (set): Domains that have already been reported (e.g. before a restart).  This set is updated as domains are found.
+
+    Yields:
+      A tuple (line number, domain, state, error).  The state is 'unchecked' for domains to be checked for availability, 'unregisterable' or 'special' for domains that will not be checked, or None if the line could not be parsed (the raw line is given in place of the domain).
+    """
+    tlds = load_tlds()
+    exclusions = load_exclusions()
+    preservations = load_preservations()
+    if seen is None:
+        seen = set()
+    ln = 0
+    for url in lines:
+        ln += 1
+        if ln <= start_line or len(url) == 0 or url[0] in '/\n':
+            continue
+        try:
+            url = url.strip()
+            if iponly_re.match(url) is not None:
+                raise ValueError(u'IP only - no domain to extract')
+            elif url.startswith('javascript:'):
+                raise ValueError(u'Javascript hook')
+            elif url.startswith('mailto:'):
+                # Only the domain of an email address is checked
+                url = url[len('mailto:'):]
+            (tld, domain, full_domain) = remove_subdomains(url, tlds)
+            if not tld.is_recognized:
+                result = (domain, u'unregisterable', u'Unregisterable TLD (%s)' % tld.domain)
+            elif not tld.is_api_registerable:
+                result = (domain, u'unregisterable', u'TLD recognized but cannot be registered through the API (%s)'% tld.domain)
+            elif domain in exclusions:
+                result = (domain, u'unregisterable', u'Domain explicitly excluded (%s)' % domain)
+            elif domain in preservations:
+                result = (full_domain, u'special', u'Domain is reserved for special processing (%s)' % domain)
+            else:
+                result = (domain, u'unchecked', None)
+            if result[0] in seen:
+                continue
+            seen.add(result[0])
+            yield (ln,) + result
+        except ValueError as e:
+            yield (ln, url, None, str(e))
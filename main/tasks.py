@@ -5,7 +5,7 @@ Domain checker background tasks for the main module.
 """
 
 from __future__ import absolute_import
-import sys, os, copy, time, logging, json, tempfile, sqlite3, traceback, datetime
+import sys, os, copy, time, logging, json, tempfile, sqlite3, traceback, datetime, uuid, contextlib
 from lxml import etree
 
 from django.db import transaction
@@ -17,167 +17,194 @@ from django.contrib.auth.models import User
 from django.core.cache import cache
 
 from domain_checker.celery import app
-from main.models import ProjectDomain, UserProject, UploadedFile, TLD, AdminSetting, ProjectTask, URLMetrics, MozLastUpdate, ProjectMetrics, ExtensionPrefix
+from main.models import ProjectDomain, UserProject, UploadedFile, TLD, AdminSetting, ProjectTask, URLMetrics, MozLastUpdate, ProjectMetrics, ExtensionPrefix, PendingWork, ProjectCounts, DomainAvailability, CacheStatistics
+from main.parsing import read_lines, extract_domains, normalize_domain
+from main.checker import NamecheapChecker
+from main.locks import get_lock, get_rate_limiter, LockLost
 
-import requests, lockfile
+import requests
 
-class NamecheapLock():
-    """
-    Represents a lock on the Namecheap API ensuring mutually exclusive access for all processes.
+TASK_HEARTBEAT_DURATION = 600
+"""Number of seconds a running project task is presumed alive for after each heartbeat (see ProjectTask)"""
 
-    .. note:: Currently implemented as a file lock through the lockfile module.
+class ProjectTaskBase(app.Task):
     """
-    def __init__(self):
-        self.lockfile = lockfile.LockFile(os.path.join(tempfile.gettempdir(), u'namecheap2'))
-
-    def acquire(self, timeout=None):
-        """
-        Acquires the lock.
+    Base class of the Celery tasks that work on a project.  The task's ProjectTask record is extended when the task starts and on each heartbeat, and removed when it returns.
+    """
+    abstract = True
 
-        Args:
-          timeout (int): Time out for acquiring the lock in seconds.
-        """
-        self.lockfile.acquire(timeout)
+    def __call__(self, *args, **kwargs):
+        self.heartbeat()
+        return super(ProjectTaskBase, self).__call__(*args, **kwargs)
 
-    def release(self):
+    def heartbeat(self):
         """
-        Releases the lock.
+        Extends the ProjectTask record of the running task.  This should be called at least once per TASK_HEARTBEAT_DURATION while the task is working.
         """
-        self.lockfile.release()
+        ProjectTask.heartbeat(self.request.id, TASK_HEARTBEAT_DURATION)
 
-class MozAPILock(NamecheapLock):
-    """
-    Represents a lock on the Moz API ensuring mutually exclusive access for all processes.
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        ProjectTask.finish(task_id)
+
+PENDING_WORK_GRACE = 15*60
+"""Number of seconds after a task is due to start before its work is checked on (see check_project_tasks)"""
+PAUSED_WORK_DELAY = 60*60
+"""Number of seconds before the pending work of a paused project is checked on again"""
 
-    .. note:: Currently implemented as a file lock with the lockfile module.
+def start_project_task(project, task, task_type, countdown=None):
     """
-    def __init__(self):
-        self.lockfile = lockfile.LockFile(os.path.join(tempfile.gettempdir(), u'mozapi2'))
+    Starts a Celery task for the given project and records it as a ProjectTask (see ProjectTaskBase).  The work is recorded as pending until the task completes it, so that it can be recovered if the task is lost.
 
-def get_task_list():
+    Args:
+      project (UserProject): The project the task is for.
+      task (Task): The Celery task to start (called with the project ID).
+      task_type (str): The type of task, one of ProjectTask.PROJ_TASK_TYPES.
+      countdown (float): Number of seconds to wait before the task is started.
     """
-    Returns a list of all currently registered Celery tasks (active, scheduled and reserved).
+    due = timezone.now() + datetime.timedelta(seconds=(countdown or 0) + PENDING_WORK_GRACE)
+    PendingWork.schedule(project, task_type, due)
+    # The task is recorded before it is queued, so even a task that starts immediately finds its record.  It is presumed alive while queued, until it is overdue.
+    project_task = ProjectTask()
+    project_task.project_id = project.id
+    project_task.celery_id = str(uuid.uuid4())
+    project_task.type = task_type
+    project_task.expires = due
+    project_task.save()
+    return task.apply_async((project.id,), countdown=countdown, task_id=project_task.celery_id)
+
+def set_project_error(project, error):
     """
-    i = app.control.inspect()
-    actives = i.active()
-    al = []
-    if actives is not None:
-        for tasks in actives.values():
-            al += tasks
-    print u'Active (%d) %s: ' % (len(al), str(al))
-    scheduled = i.scheduled()
-    sl = []
-    if scheduled is not None:
-        for tasks in scheduled.values():
-            sl += tasks
-    print u'Scheduled (%d) %s' % (len(sl), str(sl))
-    reserved = i.reserved()
-    rl = []
-    if reserved is not None:
-        for tasks in reserved.values():
-            rl += tasks
-    print u'Reserved (%s) %s: ' % (len(rl), str(rl))
-    at = al + sl + rl
-    print u'Full list (%d): %s' % (len(at), str(at))
-    return at
+    Puts the given project into the error state and notifies both the user and the administrator by email.  This should be called while handling the exception that caused the error, so its traceback can be included in the administrator email.
 
-def is_project_task_active(project, task_list):
+    Args:
+      project (UserProject): The project that encountered the error.
+      error (unicode): Description of the error.
     """
-    Returns whether there are any tasks currently running for the given project.
-
-    .. note:: Project tasks associations are not currently consistently implemented or used.
+    project.state = u'error'
+    project.error = error
+    project.updated = timezone.now()
+    project.completed_datetime = timezone.now()
+    project.save()
+    PendingWork.done(project)
+    reply_address = AdminSetting.get_value(u'noreply_address')
+    server_address = AdminSetting.get_value(u'server_address')
+    messagebody = (u'The project "%s" has encountered an error:\n\n' + \
+          u'%s\n\nYou can view the results at the following address:\n\n' + \
+          u'%s/project?id=%d\n\n' + \
+          u'Thank you for using Domain Checker.') % \
+          (project.name(), project.error, server_address, project.id)
+    user = User.objects.get(id=project.user_id)
+    send_mail(u'Domain Checker - Project "%s" Error' % (project.name(),), messagebody, reply_address, [user.email])
+
+    (exc_type, exc_value, exc_traceback) = sys.exc_info()
+    admin_email = AdminSetting.get_value(u'admin_address')
+    admin_messagebody = (u'The user "%s" has encountered an unrecoverable error for project id %d.\n\n%s') % \
+        (user.username, project.id, '\n'.join(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+    print admin_email
+    print admin_messagebody
+
+    send_mail(u'Domain Checker - User Unrecoverable Error', admin_messagebody, reply_address, [admin_email])
+
+MOZ_API_BUCKET = u'moz'
+"""Rate limiter key for Moz API calls"""
+MOZ_API_RETRY_DELAY = 60
+"""Number of seconds before a batch whose Moz API call failed is first tried again (doubled after each further failure)"""
+MOZ_API_MAX_FAILURES = 5
+"""Number of consecutive failed Moz API calls for a batch before its metrics are given up on"""
+
+class MozAPIError(Exception):
+    """
+    Raised when a Moz API call does not return a result for every URL requested.
     """
-    pts = ProjectTask.objects.filter(project_id=project.id)
-    task_list_ids = [t['id'] for t in task_list]
-    for pt in pts:
-        if pt.celery_id in task_list_ids:
-            print u'Task found for project %d' % project.id
-            return True
-    print u'Unable to find tasks for project %d.' % project.id
-    return False
 
-def check_moz_domain(m, cols, wait_time):
+def check_moz_domains(metrics, cols):
     """
-    Calls the Moz API for the url of the given URLMetric.
+    Calls the Moz API once for the urls of all the given URLMetrics, using a batch request.  The caller is responsible for keeping calls within the rate limit (see AdminSetting.get_moz_api_rate_limit), and for storing the results (see URLMetrics.store_results), which should not be done in a transaction held open during the call.
 
     Args:
-      m (URLMetrics): The metrics object whose query_url to use in the call.
+      metrics (list): The metrics objects whose query_url to use in the call.
       cols (list): A list of fields the call should return.  See the URLMetrics class for more details.
-      wait_time (int): Number of seconds to wait before releasing the API lock after the call has returned.
+
+    Returns:
+      A list of the result dictionaries, in the same order as metrics.
+
+    Raises:
+      MozAPIError: If the call failed.
     """
-    lock = MozAPILock()
-    #lock = lockfile.LockFile('/tmp/mozapi2')
-    lock.acquire()
+    if len(metrics) == 0:
+        return []
     params = AdminSetting.get_moz_params()
     params.append(('Cols', cols))
+    # A batch request posts the list of URLs, and the results are returned in the same order
+    r = requests.post(AdminSetting.get_moz_api_url()+'url-metrics/', params=params, data=json.dumps([m.query_url for m in metrics]))
     try:
-        r = requests.get(AdminSetting.get_moz_api_url()+'url-metrics/'+m.query_url, params=params)
         rtext = r.text
-        if r.status_code == 200:
-            # Retrieve the JSON result
-            rd = json.loads(rtext)
-            # Store the fields in the URLMetrics object
-            m.store_result(rd)
-            # Update the status of the URLMetrics
-            m.last_updated = timezone.now()
-            m.save()
+        if r.status_code != 200:
+            raise MozAPIError(u'Unexpected response from Moz API (code %d): %s' % (r.status_code, rtext[:200]))
+        # Retrieve the JSON results
+        results = json.loads(rtext)
+        if not isinstance(results, list) or len(results) != len(metrics):
+            raise MozAPIError(u'Moz API returned %d result(s) for %d URL(s)' % (len(results), len(metrics)))
+        print u'Done with %s' % u', '.join([m.query_url for m in metrics])
+        return results
+    finally:
         r.close()
-        print u'Done with %s, waiting (new)...' % m.query_url
-        # Wait the specified time
-        time.sleep(wait_time)
-    except Exception as e:
-        lock.release()
-        raise
-    lock.release()
 
-def get_extensions(urlmetrics):
+def get_extensions(parents):
     """
-    Returns a list of URLMetrics that represent extensions (i.e. addition of 'www.') to the given URLMetrics.
+    Returns the URLMetrics that represent extensions (i.e. addition of 'www.') to each of the given URLMetrics.  Extensions that do not exist yet are created, and only extensions not already linked to their original are updated.
+
+    Args:
+      parents (list): The URLMetrics to extend.
+
+    Returns:
+      A list of tuples of the original URLMetrics and an extension URLMetrics.
     """
     # ex_prefixes = ['www.']
-    ex_prefixes = [x.prefix+'.' for x in ExtensionPrefix.objects.all()]
+    ex_prefixes = [prefix+'.' for prefix in ExtensionPrefix.get_prefixes()]
+    # Skip any extension an object already starts with
+    extension_urls = [(um, ex+um.query_url) for um in parents for ex in ex_prefixes if not um.query_url.startswith(ex)]
+    if len(extension_urls) == 0:
+        return []
+    # Retrieve the URLMetrics objects for the extensions, creating any that do not exist
+    metrics = URLMetrics.get_or_create_all([extension_url for (um, extension_url) in extension_urls])
+    relinks = {}
     extensions = []
-    for ex in ex_prefixes:
-        if urlmetrics.query_url.startswith(ex):
-            # Skip if the given object already starts with the extension
-            continue
-        extension_url = ex+urlmetrics.query_url
-        # Check if a URLMetrics object with the given extension already exists, otherwise create it
-        try:
-            exu = URLMetrics.objects.get(query_url=extension_url)
-        except URLMetrics.DoesNotExist:
-            exu = URLMetrics(query_url=extension_url)
-        exu.extended_from = urlmetrics
-        exu.save()
-        extensions.append(exu)
+    for (um, extension_url) in extension_urls:
+        exu = metrics[extension_url]
+        if exu.extended_from_id != um.id:
+            relinks.setdefault(um.id, []).append(exu.id)
+            exu.extended_from = um
+        extensions.append((um, exu))
+    for (um_id, exu_ids) in relinks.items():
+        URLMetrics.objects.filter(id__in=exu_ids).update(extended_from=um_id)
     return extensions
 
 def associate_project_metrics(project):
     """
-    Checks to ensure that all the parsed domains of the given project are represented by a URLMetrics association.  A new URLMetrics object is created if an appropriate one does not exist.
+    Checks to ensure that all the parsed domains of the given project are represented by a URLMetrics association.  A new URLMetrics object is created if an appropriate one does not exist.  Missing associations are found by set difference and created in bulk.
 
     Args:
       project (UserProject): The project to check.
     """
-    for pd in project.projectdomain_set.all():
-        metric_associated = False
-        for um in project.urlmetrics.all():
-            if um.query_url == pd.domain:
-                metric_associated = True
-                break
-        if not metric_associated:
-            newum = None
-            try:
-                newum = URLMetrics.objects.get(query_url=pd.domain)
-            except URLMetrics.DoesNotExist:
-                newum = URLMetrics(query_url=pd.domain)
-                newum.save()
-            #newum = URLMetrics.objects.get_or_create(query_url=pd.domain)
-            pm = ProjectMetrics(project=project, urlmetrics=newum, is_checked=False, is_extension=False)
-            pm.save()
+    domains = set(project.projectdomain_set.values_list('domain', flat=True))
+    associated = set(project.urlmetrics.values_list('query_url', flat=True))
+    missing = sorted(domains.difference(associated))
+    if len(missing) == 0:
+        return
+    batch_size = AdminSetting.get_domain_batch_size()
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i+batch_size]
+        with transaction.atomic():
+            metrics = URLMetrics.get_or_create_all(batch)
+            ProjectMetrics.objects.bulk_create([ProjectMetrics(project=project, urlmetrics=metrics[domain], is_checked=False, is_extension=False) for domain in batch])
+            ProjectCounts.adjust(project, metrics_total=len(batch))
 
-@app.task(ignore_result=True)
-def update_project_metrics(project_id):
+MEASURER_LEASE_DURATION = 600
+"""Number of seconds a project measurer holds its project lock between batches"""
+
+@app.task(base=ProjectTaskBase, bind=True, ignore_result=True)
+def update_project_metrics(self, project_id):
     """
     Updates all the URLMetrics associated with the given project id through the Moz API.  If the MozRank of a URL is over the set threshold, extension URLs are created and also checked.
 
@@ -198,65 +225,108 @@ def update_project_metrics(project_id):
         'HTTP Status Code',
         'Page Authority',
         'Domain Authority'])
-    wait_time = AdminSetting.get_moz_api_wait_time()
+    rate = AdminSetting.get_moz_api_rate_limit()
+    batch_size = AdminSetting.get_moz_api_batch_size()
     mozrank_extension_threshold = AdminSetting.get_value('mozrank_extension_threshold')
-    associate_project_metrics(p)
-    pmetrics = ProjectMetrics.objects.filter(project=p, is_checked=False)
-    for pm in pmetrics:
-        with transaction.atomic():
-            if not pm.urlmetrics.is_uptodate():
-                check_moz_domain(pm.urlmetrics, cols, wait_time)
-            if not pm.is_extension and pm.urlmetrics.mozrank_10 >= mozrank_extension_threshold:
-                extensions = get_extensions(pm.urlmetrics)
-                print u'Getting extensions (%d)' % len(extensions)
-                for ex in extensions:
-                    print u'  %s' % ex.query_url
-                    try:
-                        newpm = ProjectMetrics.objects.get(project=p, urlmetrics=ex)
-                    except ProjectMetrics.DoesNotExist:
-                        newpm = ProjectMetrics(project=p, urlmetrics=ex, is_checked=True, is_extension=True)
-                    if not ex.is_uptodate():
-                        print u'  Checking extension: %s' % ex.query_url
-                        check_moz_domain(ex, cols, wait_time)
-                    else:
-                        print u'  Extension already checked: %s' % ex.query_url
-                    newpm.is_checked = True
-                    newpm.save()
-                
-            pm.is_checked=True
-            pm.save()
+    # Only one measurer may work on a project at a time (e.g. if started again by update_metrics)
+    lock = get_lock(u'measurer_%d' % project_id, MEASURER_LEASE_DURATION)
+    if not lock.acquire(0):
+        print u'Project %d is already being measured' % project_id
+        return
+    try:
+        associate_project_metrics(p)
+        while True:
+            batch = list(ProjectMetrics.objects.filter(project=p, is_checked=False).select_related('urlmetrics').order_by('id')[:batch_size])
+            if len(batch) == 0:
+                break
+            unchecked = [pm.urlmetrics for pm in batch if not pm.urlmetrics.is_uptodate()]
+            if len(unchecked) > 0 and rate is not None:
+                wait = get_rate_limiter(MOZ_API_BUCKET, rate).try_acquire()
+                if wait > 0:
+                    # Rather than holding the worker while waiting, continue in a new task once the next call is allowed
+                    print u'Moz API call not yet allowed, continuing in %.1f second(s)' % wait
+                    start_project_task(p, update_project_metrics, u'metrics', countdown=wait)
+                    return
+            lock.renew()
+            self.heartbeat()
+            try:
+                # The call is made before the transaction is opened, so no rows are locked while waiting for the API
+                results = check_moz_domains(unchecked, cols)
+                with transaction.atomic():
+                    lock.check()
+                    # Store the fields in the URLMetrics objects and update their status
+                    URLMetrics.store_results(unchecked, results, timezone.now())
+                    extensions = get_extensions([pm.urlmetrics for pm in batch if not pm.is_extension and pm.urlmetrics.mozrank_10 >= mozrank_extension_threshold])
+                    if len(extensions) > 0:
+                        print u'Getting extensions (%d)' % len(extensions)
+                        for (um, ex) in extensions:
+                            print u'  %s' % ex.query_url
+                        # Extensions are checked in a later batch
+                        associated = set(ProjectMetrics.objects.filter(project=p, urlmetrics__in=[ex.id for (um, ex) in extensions]).values_list('urlmetrics_id', flat=True))
+                        new_extensions = dict([(ex.id, ex) for (um, ex) in extensions if ex.id not in associated])
+                        ProjectMetrics.objects.bulk_create([ProjectMetrics(project=p, urlmetrics=ex, is_checked=False, is_extension=True) for ex in new_extensions.values()])
+                        ProjectCounts.adjust(p, metrics_total=len(new_extensions))
+                    measured = ProjectMetrics.objects.filter(id__in=[pm.id for pm in batch], is_checked=False).update(is_checked=True)
+                    ProjectCounts.adjust(p, metrics_checked=measured)
+            except MozAPIError as e:
+                failures = PendingWork.fail(p, u'metrics')
+                if failures < MOZ_API_MAX_FAILURES:
+                    # The batch stays unchecked, and is tried again once the API has had time to recover
+                    delay = MOZ_API_RETRY_DELAY * 2**(failures-1)
+                    print u'%s, continuing in %d second(s)' % (e, delay)
+                    start_project_task(p, update_project_metrics, u'metrics', countdown=delay)
+                    return
+                # A batch the API keeps rejecting (e.g. a URL it will not accept) would hold the project back forever, so it is marked checked with the error instead
+                print u'%s, giving up on batch after %d failed attempts' % (e, failures)
+                with transaction.atomic():
+                    lock.check()
+                    measured = ProjectMetrics.objects.filter(id__in=[pm.id for pm in batch], is_checked=False).update(is_checked=True, error=u'Moz API call failed %d times: %s' % (failures, e))
+                    ProjectCounts.adjust(p, metrics_checked=measured)
+            PendingWork.succeed(p, u'metrics')
+    except LockLost as e:
+        # Another measurer has taken over the project
+        print u'%s, stopping measurement of project %d' % (e, project_id)
+        return
+    finally:
+        lock.release()
     p.update_state()
     p.save()
+    PendingWork.done(p, u'metrics')
 
 @app.task(ignore_result=True)
 def update_metrics():
     """
-    Updates URL metrics for all projects (if not up to date).  This is intended to be a regular check (via celerybeat).
+    Updates URL metrics for all projects (if not up to date).  This is initiated manually via the administration panel; metrics measuring is otherwise started directly once a project's domains have been checked.
     """
-    with transaction.atomic():
-        for p in UserProject.objects.all():
-            if p.projectmetrics_set.filter(is_checked=False).count() > 0:
-                update_project_metrics.delay(p.id)
+    project_ids = ProjectMetrics.objects.filter(is_checked=False).values_list('project_id', flat=True).distinct()
+    for p in UserProject.objects.filter(id__in=list(project_ids)):
+        start_project_task(p, update_project_metrics, u'metrics')
 
 @app.task(ignore_result=True)
 def check_project_tasks():
     """
-    Checks to see if any incomplete projects do not currently have any running celery tasks associated with them.  This can happen if e.g. the server is reset in the middle of a check.  If one is found, the check is restarted.  This is intended to be a regular check (via celerybeat).
+    Checks to see if any overdue pending work does not currently have a live task (see ProjectTask) associated with it.  This can happen if e.g. the server is reset in the middle of a check.  If one is found, the work is restarted, and resumes from what has already been saved.  This is intended to be a regular check (via celerybeat), and costs a single indexed query while no work is overdue.
     """
-    projects = UserProject.objects.all()
-    tl = get_task_list()
-    for project in projects:
-        if not project.state in [u'measuring', u'completed', u'error', u'paused'] and not is_project_task_active(project, tl):
-            async_result = check_project_domains.delay(project.id)
-            task_id = async_result.id
-            print task_id
-            project_task = ProjectTask()
-            project_task.project_id = project.id
-            project_task.celery_id = task_id
-            project_task.type = u'checker'
-            project_task.save()
-
-            print u'Restarted task for project %d (task id: %s)' % (project.id, task_id)
+    now = timezone.now()
+    overdue = list(PendingWork.objects.filter(due__lte=now).select_related('project'))
+    # Work of paused projects is put off in one query, rather than being found overdue (and checked for a live task) on every run
+    paused = [work.id for work in overdue if work.project.state == u'paused']
+    if len(paused) > 0:
+        PendingWork.objects.filter(id__in=paused).update(due=now + datetime.timedelta(seconds=PAUSED_WORK_DELAY))
+        overdue = [work for work in overdue if work.project.state != u'paused']
+    if len(overdue) == 0:
+        return
+    live = ProjectTask.get_live([work.project_id for work in overdue], now)
+    for work in overdue:
+        project = work.project
+        if project.state in [u'completed', u'error']:
+            work.delete()
+        elif (project.id, work.type) in live:
+            # Still running, check again later
+            PendingWork.schedule(project, work.type, now + datetime.timedelta(seconds=PENDING_WORK_GRACE))
+        else:
+            async_result = start_project_task(project, PROJECT_TASKS[work.type], work.type)
+            print u'Restarted task for project %d (task id: %s)' % (project.id, async_result.id)
 
 @app.task(ignore_result=True)
 def update_tlds():
@@ -265,6 +335,8 @@ def update_tlds():
     """
     params = AdminSetting.get_api_params()
     params.append((u'Command', u'namecheap.domains.gettldlist'))
+    (rate, burst) = AdminSetting.get_api_rate_limit()
+    get_rate_limiter(u'namecheap', rate, burst).acquire()
     r = requests.get(AdminSetting.get_api_url(), params=params)
     rtext = r.text
 
@@ -298,6 +370,8 @@ def update_tlds():
                 new_tld = TLD(domain=ncd, is_recognized=True, is_api_registerable=(rel.attrib['IsApiRegisterable'] == True), description=rel.text, type=rel.attrib['Type'])
                 new_tld.save()
                 print u'New TLD added: %s' % ncd
+        # Invalidate the compiled TLD index held by every process
+        TLD.changed()
     print u'Finished processing tlds.'
 
 def parse_namecheap_result(rstring):
@@ -357,19 +431,144 @@ def check_moz_update():
         mu.datetime = timezone.make_aware(datetime.datetime.fromtimestamp(int(rd['last_update'])), timezone.get_current_timezone())
         mu.retrieved = timezone.now()
         mu.save()
+        MozLastUpdate.changed()
     r.close()
 
 
-@app.task(ignore_result=True)
-def check_project_domains(project_id):
+DOMAIN_BATCH_SIZE = 1000
+"""Default number of parsed domains (or unparseable lines) saved per transaction, see the 'domain_batch_size' setting"""
+
+def save_parsed_domains(project, projectdomains, parse_errors, lines_parsed, batch_size=DOMAIN_BATCH_SIZE):
+    """
+    Saves a batch of parsed project domains along with any parse errors, and records how far through the uploaded file parsing has progressed.
+
+    Args:
+      project (UserProject): The project being parsed.
+      projectdomains (list): ProjectDomain objects to save.
+      parse_errors (list): Parse error strings for lines that could not be parsed.
+      lines_parsed (int): Number of lines of the uploaded file parsed so far.
+      batch_size (int): Maximum number of rows inserted per query.
+    """
+    with transaction.atomic():
+        ProjectDomain.objects.bulk_create(projectdomains, batch_size=batch_size)
+        ProjectCounts.add_domains(project, [d.state for d in projectdomains])
+        if len(parse_errors) > 0:
+            project.parse_errors = (project.parse_errors or u'') + u''.join(parse_errors)
+        project.lines_parsed = lines_parsed
+        project.last_updated = timezone.now()
+        project.save(update_fields=['parse_errors', 'lines_parsed', 'last_updated'])
+
+@app.task(base=ProjectTaskBase, bind=True, ignore_result=True)
+def parse_project(self, project_id):
+    """
+    Parses the uploaded file of the given project id into project domains, which are saved in batches as the file is read.  Progress is recorded on the project so that a restarted task resumes after the last saved batch.  Once parsing is complete, the availability check is started.
+
+    Args:
+      project_id (int): The ID of the project to parse.
+    """
+    project = UserProject.objects.get(id=project_id)
+    try:
+        batch_size = AdminSetting.get_domain_batch_size()
+        projectfile = UploadedFile.objects.get(project_id=project.id)
+        # Domains saved before any restart must not be added again
+        seen = set(project.projectdomain_set.values_list('domain', flat=True))
+        projectdomains = []
+        parse_errors = []
+        # The file is closed even if parsing fails, as the worker outlives the task
+        with contextlib.closing(projectfile.open_data()) as data:
+            for (ln, domain, state, error) in extract_domains(read_lines(data), start_line=project.lines_parsed, seen=seen):
+                if state is None:
+                    parse_errors.append(u'%d: %s (%s)\n' % (ln, domain, error))
+                else:
+                    projectdomains.append(ProjectDomain(domain=domain, subdomains_preserved=False, is_checked=(state != u'unchecked'), state=state, last_checked=timezone.now(), project_id=project.id, error=error))
+                if len(projectdomains) + len(parse_errors) >= batch_size:
+                    save_parsed_domains(project, projectdomains, parse_errors, ln, batch_size)
+                    self.heartbeat()
+                    projectdomains = []
+                    parse_errors = []
+        save_parsed_domains(project, projectdomains, parse_errors, project.lines_total, batch_size)
+
+        # If any lines failed, notify the user
+        if project.parse_errors:
+            error_email = u'The following domains failed while reading the file "%s":\n\n' % projectfile.filename
+            error_email += u''.join([u'Line %s\n' % line for line in project.parse_errors.splitlines()])
+            send_mail(u'Domain Checker: Failed Domains', error_email, AdminSetting.get_value('noreply_address'), [project.user.email])
+    except Exception as e:
+        set_project_error(project, u'Error occurred while parsing domains - %s' % str(e).encode('utf-8'))
+
+        # Propagate error to Celery handler
+        raise
+
+    if project.projectdomain_set.count() == 0:
+        project.state = u'completed'
+        project.completed_datetime = timezone.now()
+        project.save()
+    else:
+        project.state = u'checking'
+        project.save()
+        start_project_task(project, check_project_domains, u'checker')
+    PendingWork.done(project, u'parser')
+
+def save_domain_results(project, domains, lock=None):
+    """
+    Saves the availability check results of a batch of project domains in a single transaction.  Domains are updated in bulk (one query per distinct result), metrics associations are created in bulk for the available ones, and the project counts are adjusted to match.  Only domains still unchecked are saved, so saving a batch again (e.g. a redelivered or overlapping one) changes nothing.
+
+    Args:
+      project (UserProject): The project the domains belong to.
+      domains (list): The checked ProjectDomain objects, with their state and error already set.
+      lock (DatabaseLock): If given, the results are only saved while this lock is still held.
+
+    Raises:
+      LockLost: If the lock has been lost, in which case nothing is saved.
+    """
+    now = timezone.now()
+    results = {}
+    for d in domains:
+        d.is_checked = True
+        d.last_checked = now
+        results.setdefault((d.state, d.error), []).append(d.id)
+    with transaction.atomic():
+        if lock is not None:
+            lock.check()
+        # The domains still unchecked are locked until the transaction ends, so that only they are saved, associated and counted
+        unchecked = set(ProjectDomain.objects.select_for_update().filter(id__in=[d.id for d in domains], is_checked=False).values_list('id', flat=True))
+        deltas = {}
+        for ((state, error), ids) in results.items():
+            ids = [i for i in ids if i in unchecked]
+            if len(ids) == 0:
+                continue
+            ProjectDomain.objects.filter(id__in=ids).update(state=state, error=error, is_checked=True, last_checked=now)
+            deltas[u'domains_unchecked'] = deltas.get(u'domains_unchecked', 0) - len(ids)
+            deltas[u'domains_checked'] = deltas.get(u'domains_checked', 0) + len(ids)
+            deltas[u'domains_' + state] = deltas.get(u'domains_' + state, 0) + len(ids)
+        available = [d.domain for d in domains if d.state == u'available' and d.id in unchecked]
+        if len(available) > 0:
+            metrics = URLMetrics.get_or_create_all(available)
+            ProjectMetrics.objects.bulk_create([ProjectMetrics(project=project, urlmetrics=metrics[domain], is_checked=False, is_extension=False) for domain in available])
+            deltas[u'metrics_total'] = len(available)
+        ProjectCounts.adjust(project, **deltas)
+
+AVAILABILITY_CACHE_KEY = u'availability'
+"""Statistics key of the shared domain availability cache (see CacheStatistics)"""
+CHECKER_LEASE_DURATION = 600
+"""Number of seconds a project checker holds its project lock between batches"""
+MAX_RESULT_MISSES = 3
+"""Number of consecutive API responses a requested domain may be missing from before it is marked as an error"""
+
+@app.task(base=ProjectTaskBase, bind=True, ignore_result=True)
+def check_project_domains(self, project_id):
     """
     Use the Namecheap API to update availability status for all the domains associated with the given project.
 
     Args:
       project_id (int): The ID of the project to check domains for.
     """
-    lock = NamecheapLock()
     project = UserProject.objects.get(id=project_id)
+    # Only one checker may work on a project at a time (e.g. if a check is restarted while the original is still running)
+    lock = get_lock(u'checker_%d' % project_id, CHECKER_LEASE_DURATION)
+    if not lock.acquire(0):
+        print u'Project %d is already being checked' % project_id
+        return
     # Enable debug output
     if settings.DEBUG:
         logging.basicConfig() 
@@ -377,48 +576,55 @@ def check_project_domains(project_id):
         requests_log = logging.getLogger(u'requests.packages.urllib3')
         requests_log.setLevel(logging.DEBUG)
         requests_log.propagate = True
-    while True:
-        lock.acquire()
-        try:
-            # Retrieve list of unchecked domains (limited by the set limit of domains per call)
-            domain_list = project.projectdomain_set.filter(is_checked=False)[:AdminSetting.get_api_urls_per_request()]
-            # If no domains unchecked, progress project to the next stage (usually metrics measuring)
-            if domain_list.count() == 0:
-                print u'No domains found.'
-                project.update_state(save=False)
-                project.save()
-
-                lock.release()
-                break
 
+    # Number of consecutive responses each requested domain (by ID) has been missing from
+    misses = {}
+
+    def next_batch(in_flight):
+        """
+        Returns the next unchecked domains (limited by the set limit of domains per call), excluding those already in flight.  Domains with a fresh result in the availability cache are saved straight away rather than returned.
+        """
+        while True:
+            domain_list = list(project.projectdomain_set.filter(is_checked=False).exclude(domain__in=in_flight)[:AdminSetting.get_api_urls_per_request()])
             # Fold the list into a dictionary for easy reference
             domains = dict([(d.domain, d) for d in domain_list])
-            domain_str = u','.join(domains.keys())
-
-            params = AdminSetting.get_api_params()
-            params.append((u'Command', u'namecheap.domains.check'))
-            params.append((u'DomainList', domain_str))
-
-            print u'Domains that will be checked: %s' % domain_str
-            print params
-
-            # Make the call to the Namecheap API (retry 3 times then fail)
-            retries = 0
-            while True:
-                try:
-                    r = requests.get(AdminSetting.get_api_url(), params=params)
-                    break
-                except requests.exceptions.ConnectionError as ce:
-                    retries += 1
-                    if retries >= 3:
-                        raise ce
-                    time.sleep(5)
-
-            sc = r.status_code
+            if cache_ttl > 0:
+                fresh = DomainAvailability.get_fresh([normalize_domain(domain) for domain in domains.keys()], cache_ttl)
+                cached = []
+                for (domain, d) in domains.items():
+                    available = fresh.get(normalize_domain(domain))
+                    if available is not None:
+                        d.state = u'available' if available else u'unavailable'
+                        cached.append(d)
+                        del domains[domain]
+                CacheStatistics.record(AVAILABILITY_CACHE_KEY, len(cached), len(domains))
+                if len(cached) > 0:
+                    print u'Domains found in availability cache: %s' % u','.join([d.domain for d in cached])
+                    save_domain_results(project, cached, lock)
+                if len(domains) == 0 and len(cached) > 0:
+                    # The whole batch was cached, so move on to the next one
+                    continue
+            if len(domains) > 0:
+                print u'Domains that will be checked: %s' % u','.join(domains.keys())
+            return domains
+
+    try:
+        params = AdminSetting.get_api_params()
+        params.append((u'Command', u'namecheap.domains.check'))
+        print params
+
+        # Calls are pipelined (several in flight at once) and share the same rate limit across all projects and processes
+        cache_ttl = AdminSetting.get_availability_cache_ttl()
+        (rate, burst) = AdminSetting.get_api_rate_limit()
+        limiter = get_rate_limiter(u'namecheap', rate, burst)
+        checker = NamecheapChecker(AdminSetting.get_api_url(), params, limiter.acquire, in_flight=AdminSetting.get_api_requests_in_flight())
+
+        for (domains, sc, rxml) in checker.run(next_batch):
             print u'Status code: %d' % sc
+            lock.renew()
+            self.heartbeat()
 
             if sc == 200:
-                rxml = r.text.encode(u'utf-8')
                 (domain_results, error_results) = parse_namecheap_result(rxml)
                 if len(domain_results) == 0 and len(error_results) > 0:
                     # Handle specific but rare Namecheap API errors gracefully
@@ -428,18 +634,14 @@ def check_project_domains(project_id):
                             for domain, d in domains.items():
                                 d.state = u'error'
                                 d.error = u'API unable to parse TLD for this domain (possible encoding issue)'
-                                d.is_checked = True
-                                d.last_checked = timezone.now()
-                                d.save()
+                            save_domain_results(project, domains.values(), lock)
                             break
                         elif int(er[u'number']) == 3031510:
                             # Denied authorization for this domain
                             for domain, d in domains.items():
                                 d.state = u'error'
                                 d.error = u'API denies authorisation to check this domain (reason not given)'
-                                d.is_checked = True
-                                d.last_checked = timezone.now()
-                                d.save()
+                            save_domain_results(project, domains.values(), lock)
                             break
                         else:
                             # Assume catastrophic error
@@ -450,76 +652,61 @@ def check_project_domains(project_id):
                 """
                 Match the call results to the domain list and store them.  If appropriate, create and associate a metrics object for the project.
                 """
+                domain_index = dict([(normalize_domain(key), d) for key, d in domains.items()])
+                checked_domains = []
                 for dr in domain_results:
-                    print u'Finding match for "%s"...' % (dr[u'domain'])
-                    for key in domains.keys():
-                        # We use endswith to handle mailto: addresses, TODO: These should be handled at the parsing stage
-                        if key.endswith(dr[u'domain']):
-                            d = domains[key]
-                            if dr[u'errorno'] != 0:
-                                d.state = u'error'
-                                d.error = u'API error (%d): %s' % (dr[u'errorno'], dr[u'description'])
-                                print dr
-                            else:
-                                d.state = u'available' if dr[u'available'] else u'unavailable'
-                                d.description = None
-                            d.is_checked = True
-                            d.last_checked = timezone.now()
-                            d.save()
-                            if d.state == u'available':
-                                try:
-                                    um = URLMetrics.objects.get(query_url=d.domain)
-                                except URLMetrics.DoesNotExist:
-                                    um = URLMetrics(query_url=d.domain)
-                                    um.save()
-                                pm = ProjectMetrics(project=project, urlmetrics=um, is_checked=False, is_extension=False)
-                                pm.save()
-                            break
-
-                # Make a debug note if a requested domain does not appear in the results (likely an error occurred)
+                    d = domain_index.get(normalize_domain(dr[u'domain']))
+                    if d is None:
+                        print u'No requested domain matches result "%s"' % (dr[u'domain'])
+                        continue
+                    if dr[u'errorno'] != 0:
+                        d.state = u'error'
+                        d.error = u'API error (%d): %s' % (dr[u'errorno'], dr[u'description'])
+                        print dr
+                    else:
+                        d.state = u'available' if dr[u'available'] else u'unavailable'
+                    checked_domains.append(d)
+                # A requested domain missing from the results is left unchecked and requested again, unless it keeps missing (e.g. one the API rewrites beyond recognition), as it would otherwise be requested forever
                 for domain, d in domains.items():
                     if d.state == u'unchecked':
-                        print u'Domain result not found (will recheck later): %s' % domain
+                        misses[d.id] = misses.get(d.id, 0) + 1
+                        if misses[d.id] < MAX_RESULT_MISSES:
+                            print u'Domain result not found (will recheck later): %s' % domain
+                            continue
+                        print u'Domain result not found %d times: %s' % (misses[d.id], domain)
+                        d.state = u'error'
+                        d.error = u'API returned no result for this domain'
+                        checked_domains.append(d)
+                    else:
+                        misses.pop(d.id, None)
+                save_domain_results(project, checked_domains, lock)
+                # Share the results with other checks, unless the API returned an error for the domain
+                DomainAvailability.store(dict([(normalize_domain(d.domain), d.state == u'available') for d in checked_domains if d.state != u'error']), timezone.now())
             else:
                 print u'Warning: Unexpected response while calling API code: %d, will retry after delay' % sc
+    except LockLost as e:
+        # Another checker has taken over the project
+        print u'%s, stopping check of project %d' % (e, project_id)
+        return
+    except Exception as e:
+        # A fatal error has occurred, set the project state appropriately and send an email to the user.
+        set_project_error(project, u'Error occurred while checking domains - %s' % str(e).encode('utf-8'))
 
-            r.close()
-            time.sleep(AdminSetting.get_api_wait_time())
-            lock.release()
-        except Exception as e:
-            lock.release()
-
-            # A fatal error has occurred, set the project state appropriately and send an email to the user.
-            project.state = u'error'
-            project.error = u'Error occurred while checking domains - %s' % str(e).encode('utf-8')
-            project.updated = timezone.now()
-            project.completed_datetime = timezone.now()
-            project.save()
-            reply_address = AdminSetting.get_value(u'noreply_address')
-            server_address = AdminSetting.get_value(u'server_address')
-            messagebody = (u'The project "%s" has encountered an error:\n\n' + \
-                  u'%s\n\nYou can view the results at the following address:\n\n' + \
-                  u'%s/project?id=%d\n\n' + \
-                  u'Thank you for using Domain Checker.') % \
-                  (project.name(), project.error, server_address, project.id)
-            user = User.objects.get(id=project.user_id)
-            send_mail(u'Domain Checker - Project "%s" Error' % (project.name(),), messagebody, reply_address, [user.email])
-
-            (exc_type, exc_value, exc_traceback) = sys.exc_info()
-            admin_email = AdminSetting.get_value(u'admin_address')
-            admin_messagebody = (u'The user "%s" has encountered an unrecoverable error for project id %d.\n\n%s') % \
-                (user.username, project.id, '\n'.join(traceback.format_exception(exc_type, exc_value, exc_traceback)))
-            print admin_email
-            print admin_messagebody
-                
-            send_mail(u'Domain Checker - User Unrecoverable Error', admin_messagebody, reply_address, [admin_email])
-
-            # Propagate error to Celery handler
-            raise
-
-        project.update_state()
-        # If any domains require metrics retrieval, start the appropriate background task
-        if project.state == u'measuring':
-            update_project_metrics.delay(project.id)
-
+        # Propagate error to Celery handler
+        raise
+    finally:
+        lock.release()
 
+    # No domains left unchecked, progress project to the next stage (usually metrics measuring)
+    project.update_state()
+    # If any domains require metrics retrieval, start the appropriate background task
+    if project.state == u'measuring':
+        start_project_task(project, update_project_metrics, u'metrics')
+    PendingWork.done(project, u'checker')
+
+PROJECT_TASKS = {
+    u'parser' : parse_project,
+    u'checker' : check_project_domains,
+    u'metrics' : update_project_metrics,
+}
+"""Celery task performing each type of project work, see ProjectTask.PROJ_TASK_TYPES"""
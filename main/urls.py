@@ -23,5 +23,8 @@ urlpatterns = patterns('',
     url(r'^update_metrics$', views.manual_update_metrics, name='update_metrics'),
     url(r'^update_states$', views.manual_update_states, name='upload_states'),
     url(r'^project$', views.project, name='project'),
+    url(r'^project_domains$', views.project_domains, name='project_domains'),
+    url(r'^project_metrics$', views.project_metrics, name='project_metrics'),
+    url(r'^project_export$', views.project_export, name='project_export'),
     url(r'^admin_settings/$', views.admin_settings, name='admin_settings'),
     url(r'^upload_project$', views.upload_project, name='upload_project'))
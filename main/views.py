@@ -4,7 +4,7 @@ Domain checker views for the main module.
 .. moduleauthor:: Chris Davoren <cdavoren@gmail.com>
 """
 from __future__ import absolute_import
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.core.cache import cache
 from django.core.mail import send_mail
@@ -12,85 +12,18 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
+from django.db import transaction, connection
 from django.db.models import Q
 from django.utils import timezone
 from main.forms import URLFileForm
-from main.models import TLD, ExcludedDomain, UserProject, UploadedFile, ProjectDomain, PreservedDomain, ProjectTask, AdminSetting, ExtensionPrefix, ProjectMetrics
-from main.tasks import check_project_domains, update_tlds, update_metrics
+from main.models import ExcludedDomain, UserProject, UploadedFile, ProjectDomain, PreservedDomain, AdminSetting, ExtensionPrefix, ProjectMetrics, CacheStatistics
+from main.tasks import start_project_task, parse_project, update_tlds, update_metrics, AVAILABILITY_CACHE_KEY, PROJECT_TASKS
+from main.export import export_rows, EXPORT_FORMATS
 
 import os, logging, re, json, string, random
-from urlparse import urlparse
-from domain_checker.celery import app
 
 logger = logging.getLogger(__name__)
 """Logger name for the view module"""
-schemecheck_re = re.compile(r'[^\.]*?//')
-"""Regular expression for checking whether a scheme has been specified for a URL"""
-iponly_re = re.compile(r'[^\.]*?//([0-9]{1,3}\.){3}[0-9]{1,3}[/$]')
-"""Regular expression for checking whether a URL is an IP (not a domain name)"""
-portend_re = re.compile(r'(.*?):[0-9]+$')
-"""Regular expression for checking if there is a port number in a URL"""
-
-def get_task_list():
-    """
-    Returns a list of all currently registered Celery tasks (active, scheduled and reserved).
-    """
-    i = app.control.inspect()
-    actives = i.active()
-    al = []
-    if actives is not None:
-        for tasks in actives.values():
-            al += tasks
-    logger.debug('Active (%d) %s: ' % (len(al), str(al)))
-    scheduled = i.scheduled()
-    sl = []
-    if scheduled is not None:
-        for tasks in scheduled.values():
-            sl += tasks
-    logger.debug('Scheduled (%d) %s' % (len(sl), str(sl)))
-    reserved = i.reserved()
-    rl = []
-    if reserved is not None:
-        for tasks in reserved.values():
-            rl += tasks
-    logger.debug('Reserved (%s) %s: ' % (len(rl), str(rl)))
-    at = al + sl + rl
-    logger.debug('Full list (%d): %s' % (len(at), str(at)))
-    return at
-
-def is_project_task_active(project, task_list):
-    """
-    Returns whether there are any tasks currently running for the given project.
-
-    .. note:: Project tasks associations are not currently consistently implemented or used.
-    """
-    pts = ProjectTask.objects.filter(project_id=project.id)
-    task_list_ids = [t['id'] for t in task_list]
-    for pt in pts:
-        if pt.celery_id in task_list_ids:
-            logger.debug('Task found for project %d' % project.id)
-            return True
-    logger.debug('Unable to find tasks for project %d.' % project.id)
-    return False
-        
-def load_tlds():
-    """
-    Returns the stored list of recognized top-level domains.
-    """
-    return [unicode(tld.domain) for tld in TLD.objects.all().order_by('-is_recognized','-is_api_registerable')]
-
-def load_exclusions():
-    """
-    Returns the stored list of domains that should be excluded from availability checking.
-    """
-    return [unicode(exclusion.domain) for exclusion in ExcludedDomain.objects.all()]
-
-def load_preservations():
-    """
-    Returns the stored list of domains for which subdomains should be preserved.
-    """
-    return [unicode(preservation.domain) for preservation in PreservedDomain.objects.all()]
 
 def deep_delete_project(project):
     """
@@ -101,6 +34,9 @@ def deep_delete_project(project):
     """
     try:
         uploaded_file = UploadedFile.objects.get(project_id=project.id)
+        # The stored upload is not removed along with its record
+        if uploaded_file.datafile:
+            uploaded_file.datafile.delete(save=False)
         uploaded_file.delete()
     except UploadedFile.DoesNotExist:
         pass
@@ -114,123 +50,6 @@ def deep_delete_project(project):
 
     project.delete()
 
-def remove_subdomains(url, tlds):
-    """
-    Takes a given URL and returns the corresponding top-level domain.  Note that this code has been adapted from an answer on StackOverflow.
-
-    Args:
-      url (str): The url to find the TLD for.
-      tlds (list): A list of recognized TLD's.
-
-    Raises:
-      ValueError: If the TLD of the URL is not recognized.
-    """
-    # Checks for presence of // before domain (required by urlparse).  If it does not exist, add it.
-    if schemecheck_re.match(url) == None:
-        url = u'//'+url
-
-    # Use URL to retrieve the full domain name (including subdomains)
-    full_domain = urlparse(url, scheme='http')[1]
-
-    # Split the parsed domain into elements to recognise the portion that represents the TLD
-    url_elements = full_domain.split('.')
-    if len(url_elements) > 0:
-        pe = portend_re.match(url_elements[-1])
-        if pe is not None:
-            url_elements[-1] = pe.group(1)
-    for i in range(-len(url_elements), 0):
-        last_i_elements = url_elements[i:]
-        #    i=-3: ["abcde","co","uk"]
-        #    i=-2: ["co","uk"]
-        #    i=-1: ["uk"] etc
-
-        candidate = u".".join(last_i_elements) # abcde.co.uk, co.uk, uk
-        wildcard_candidate = u".".join(["*"] + last_i_elements[1:]) # *.co.uk, *.uk, *
-        exception_candidate = u"!" + candidate
-
-        # match
-        if (exception_candidate in tlds):
-            return (exception_candidate, u".".join(url_elements[i:]), full_domain) 
-        elif (candidate in tlds):
-            return (candidate, u".".join(url_elements[i-1:]), full_domain)
-        """
-        # The wildcard format plays havoc with the way NameCheap TLDs are processed, so we skip this
-        elif (wildcard_candidate in tlds):
-            return (wildcard_candidate, ".".join(url_elements[i-1:]), full_domain)
-        """
-
-    # The TLD of this URL is not recognised
-    logger.debug(url_elements)
-    raise ValueError(u"Invalid address or domain not in recognized list of TLDs")
-
-def extract_domains(file_content, fail_email, filename):
-    """
-    Takes the contents of an uploaded file and returns a series a tuple of results representing parsed domains of different types.  If any lines in the file cannot be parsed, an email notification is sent to the given address with details.
-
-    Args:
-      file_content (str): The raw content of the file.
-      fail_email (str): Email address of user to notify if there is a fatal error
-      filename (str): The original filename
-
-    Returns:
-      A tuple containing three items:
-         1.  Correctly parsed domains
-         2.  Domains that failed, are unrecognized or unregisterable
-         3.  A list of lines in the file that could not be parsed
-    """
-    tlds = load_tlds()
-    exclusions = load_exclusions()
-    preservations = load_preservations()
-    domain_list = set()
-    ln = 0
-    failed_lines = []
-    failed_domains = []
-    failed_set = set()
-    for url in file_content.split('\n'):
-        ln += 1
-        logger.debug(type(url))
-        # url = url.decode('utf-8')
-        # url = unicode(url, errors='ignore')
-        if len(url) == 0 or url[0] in '/\n':
-            continue
-        # logger.debug(url.strip())
-        try:
-            url = url.strip()
-            if iponly_re.match(url) is not None:
-                raise ValueError(u'IP only - no domain to extract')
-            elif url.startswith('javascript:'):
-                raise ValueError(u'Javascript hook')
-            (tld_match, domain, full_domain) = remove_subdomains(url.strip(), tlds)
-            tld = TLD.objects.get(domain=tld_match)
-            if domain in failed_set:
-                continue
-            if not tld.is_recognized:
-                failed_domains.append((domain, u'unregisterable', u'Unregisterable TLD (%s)' % tld_match))
-                failed_set.add(domain)
-            elif not tld.is_api_registerable:
-                failed_domains.append((domain, u'unregisterable', u'TLD recognized but cannot be registered through the API (%s)'% tld_match))
-                failed_set.add(domain)
-            elif domain in exclusions:
-                failed_domains.append((domain, u'unregisterable', u'Domain explicitly excluded (%s)' % domain))
-                failed_set.add(domain)
-            elif domain in preservations:
-                failed_domains.append((full_domain, u'special', u'Domain is reserved for special processing (%s)' % domain))
-                failed_set.add(full_domain)
-            else:
-                domain_list.add(domain)
-        except ValueError as e:
-            failed_lines.append((ln, url.strip(), str(e)))
-
-    if len(failed_lines) > 0:
-        error_email = u'The following domains failed while reading the file "%s":\n\n' % filename.encode('utf-8')
-        for fd in failed_lines:
-            error_email += u'Line %d: %s (%s)\n' % (fd[0], 
-                fd[1],
-                fd[2])
-        logger.debug(error_email)
-        send_mail(u'Domain Checker: Failed Domains', error_email, AdminSetting.get_value('noreply_address'), [fail_email])
-    return (domain_list, failed_domains, failed_lines)
-
 def index(request):
     """
     View: The root page.
@@ -287,10 +106,47 @@ def profile(request):
             'profile_message' : profile_message, 
             'profile_messagetype' : profile_messagetype,})
 
+PROJECT_LIST_PAGE_SIZE = 50
+"""Number of projects shown per page of the project listing"""
+
+def get_project_page_query(user, after=None):
+    """
+    Returns the ordered queryset of the given user's projects after the given one (see get_project_page).  The filename is read by a correlated subquery rather than an aggregate, as the GROUP BY an aggregate requires would stop the database from reading the projects in order from the (user, created, id) index and force it to sort them.
+
+    Args:
+      user (User): The user whose projects to list.
+      after (int): The ID of the last project of the previous page, or None for the first page.
+    """
+    qn = connection.ops.quote_name
+    filename = u'SELECT MAX(%s) FROM %s WHERE %s = %s.%s' % (qn(u'filename'), qn(UploadedFile._meta.db_table), qn(u'project_id'), qn(UserProject._meta.db_table), qn(u'id'))
+    projects = UserProject.objects.filter(user=user).select_related('counts').extra(select={'filename' : filename})
+    if after is not None:
+        last = UserProject.objects.filter(user=user, id=after).values_list('created', flat=True)
+        if len(last) > 0:
+            projects = projects.filter(Q(created__lt=last[0]) | Q(created=last[0], id__lt=after))
+    return projects.order_by('-created', '-id')
+
+def get_project_page(user, after=None, page_size=PROJECT_LIST_PAGE_SIZE):
+    """
+    Returns a page of the given user's projects, newest first, in a single query.  Each project is returned with its filename and counts (see ProjectCounts).  Pages are selected by keyset (the created date/time and ID of the last project of the previous page), so later pages cost no more than the first.
+
+    Args:
+      user (User): The user whose projects to list.
+      after (int): The ID of the last project of the previous page, or None for the first page.
+      page_size (int): Maximum number of projects on the page.
+
+    Returns:
+      A tuple of the list of projects and the ID to request the next page with (or None if this is the last page).
+    """
+    projects = list(get_project_page_query(user, after)[:page_size+1])
+    if len(projects) > page_size:
+        return (projects[:page_size], projects[page_size-1].id)
+    return (projects, None)
+
 @login_required(login_url='/')
 def project_list(request):
     """
-    View:  Project list for an authenticated user.  Redirects to index page if unauthenticated.
+    View:  Project list for an authenticated user, paged by the 'after' parameter (see get_project_page).  Redirects to index page if unauthenticated.
     """
     if not request.user.is_authenticated():
         return redirect('index')
@@ -302,20 +158,19 @@ def project_list(request):
         del request.session['profile_message']
         del request.session['profile_messagetype']
     uploadform = URLFileForm(request.POST, request.FILES)
-    projects = UserProject.objects.filter(user_id=request.user.id).order_by('-created')
-    for project in projects:
-        try:
-            project.file = UploadedFile.objects.get(project_id=project.id)
-            logger.debug('Filename: %s' % project.file.filename)
-        except UploadedFile.DoesNotExist:
-            pass
-        project.domains = ProjectDomain.objects.filter(project_id=project.id)
+    try:
+        after = int(request.GET['after']) if 'after' in request.GET else None
+    except ValueError:
+        after = None
+    (projects, next_after) = get_project_page(request.user, after)
     return render(
         request,
         'main/project_list.html',
         {
             'user' : request.user,
             'projects' : projects,
+            'is_first_page' : after is None,
+            'next_after' : next_after,
             'uploadform' : uploadform, 
             'profile_message' : profile_message,
             'profile_messagetype' : profile_messagetype,})
@@ -323,7 +178,7 @@ def project_list(request):
 @login_required(login_url='/')
 def upload_project(request):
     """
-    View:  Processes new project file upload of an authenticated user.  Redirects to index page if unauthenticated.  Otherwise once the file is parsed for domains to process, the user is redirected back to their project listing with an appropriate success or failure message.
+    View:  Processes new project file upload of an authenticated user.  Redirects to index page if unauthenticated.  Otherwise once the file is stored and queued for parsing, the user is redirected back to their project listing with an appropriate success or failure message.
     """
     if not request.user.is_authenticated():
         logger.debug('Unauthenticated user.')
@@ -334,49 +189,27 @@ def upload_project(request):
         logger.debug('Attempting to upload project...')
         if uploadform.is_valid():
             logger.debug('Form is valid.')
-            file_contents = unicode(request.FILES['file'].read(), errors='ignore')
-            (domain_list, failed_domains, failed_lines) = extract_domains(file_contents, request.user.email, request.FILES['file'].name)
-            projectdomains = []
+            upload = request.FILES['file']
+            # Count the lines chunk by chunk, so the file is never read into memory as a whole
+            lines_total = 1
+            for chunk in upload.chunks():
+                lines_total += chunk.count('\n')
             with transaction.atomic():
-                project = UserProject(state='checking', last_updated=timezone.now(), user_id=request.user.id)
-                parse_error_str = ''
-                # If any lines failed, track them
-                if len(failed_lines) > 0:
-                    for fd in failed_lines:
-                        parse_error_str += '%d: %s (%s)\n' % (fd[0], fd[1], fd[2])
-                    project.parse_errors = parse_error_str
+                project = UserProject(state='parsing', last_updated=timezone.now(), user_id=request.user.id, lines_total=lines_total)
                 project.save()
 
-                # Store uploaded file in database
-                projectfile = UploadedFile(filename=request.FILES['file'].name, filedata=file_contents, project_id=project.id)
-
-                # Create and associate project domain records
-                for domain in domain_list:
-                    projectdomains.append(ProjectDomain(domain=domain, subdomains_preserved=False, is_checked=False, state='unchecked', last_checked=timezone.now(), project_id=project.id))
-                for (domain, state, error) in failed_domains:
-                    projectdomains.append(ProjectDomain(domain=domain, subdomains_preserved=False, is_checked=True, state=state, last_checked=timezone.now(), project_id=project.id, error=error))
+                # Store uploaded file in the media storage, which also copies it in chunks (domains are parsed from it in the background)
+                projectfile = UploadedFile(filename=upload.name, project_id=project.id)
+                projectfile.datafile.save(upload.name, upload, save=False)
                 projectfile.save()
-                [pd.save() for pd in projectdomains]
 
-            # Initial celery task to check availability of parsed domains
-            if project.projectdomain_set.exclude(state='error').count() == 0:
-                project.state = 'completed'
-                project.save()
-                request.session['profile_message'] = 'Project "%s" successfully uploaded but no valid domains were found for checking.' % request.FILES['file'].name
-                request.session['profile_messagetype'] = 'warning'
-            else:
-                task_id = check_project_domains.delay(project.id)
+            # Initial celery task to parse the domains (which in turn starts the availability check)
+            start_project_task(project, parse_project, 'parser')
 
-                project_task = ProjectTask()
-                project_task.project_id = project.id
-                project_task.celery_id = task_id
-                project_task.type = 'checker'
-                project_task.save()
+            request.session['profile_message'] = 'Project "%s" successfully uploaded.  You will be emailed when domain checking is complete.' % request.FILES['file'].name
+            request.session['profile_messagetype'] = 'success'
 
-                request.session['profile_message'] = 'Project "%s" successfully uploaded.  You will be emailed when domain checking is complete.' % request.FILES['file'].name
-                request.session['profile_messagetype'] = 'success'
-
-                return redirect('project_list')
+            return redirect('project_list')
         else:
             # If an error occurred, inform the user
             logger.debug(uploadform.errors)
@@ -502,6 +335,7 @@ def update_admin(request):
                 continue
             ep = ExtensionPrefix(prefix=x)
             ep.save()
+        ExtensionPrefix.changed()
 
         # Note that the field names are used to determine the AdminSetting key
         ads = AdminSetting.objects.all()
@@ -514,10 +348,13 @@ def update_admin(request):
                 if len(request.POST[ad.key]) == 0:
                     request.session['profile_message'] = '<b>Error updating settings:</b> Field "%s" cannot be blank' % ad.key
                     request.session['profile_messagetype'] = 'error'
+                    # Settings saved before the blank field are kept
+                    AdminSetting.changed()
                     return redirect('admin_settings')
                 else:
                     ad.value = request.POST[ad.key]
                     ad.save()
+        AdminSetting.changed()
 
         staff = request.POST['staff']
         staff_list = []
@@ -604,7 +441,7 @@ def reset_user(request):
 @login_required(login_url='/')
 def project(request):
     """
-    View:  Lists details of a specific project for an authenticated user, including domains, metrics, errors and other messages.
+    View:  Lists details of a specific project for an authenticated user, including progress, errors and other messages.  The domains and metrics themselves are loaded by the page on demand (see project_domains and project_metrics).
     """
     if not request.user.is_authenticated() or request.method != 'GET':
         return redirect('index')
@@ -619,22 +456,13 @@ def project(request):
 
         project_file = UploadedFile.objects.get(project_id=project.id)
 
-        project_domains = project.projectdomain_set.all().order_by('-is_checked', 'state', 'domain')
-        checkable_domains = project_domains.exclude(state__in=['error', 'unregisterable', 'special'])
-        completed_domains = project_domains.filter(is_checked=True)
-        unregisterable_domains = completed_domains.filter(state='unregisterable')
-        special_domains = project_domains.filter(state='special')
-        error_domains = project_domains.filter(state='error')
-
         return render(
             request, 
             'main/project.html', {
                 'project' : project, 
                 'project_file' : project_file, 
-                'domains' : checkable_domains, 
-                'errors' : error_domains, 
-                'unregisterables' : unregisterable_domains, 
-                'specials' : special_domains, 
+                'counts' : project.get_counts(), 
+                'checkable_states' : u','.join(CHECKABLE_STATES), 
                 'project_error_formatted' : None if project.error is None else project.error.replace('\n', '<br />') 
         })
     except UserProject.DoesNotExist as e:
@@ -642,6 +470,147 @@ def project(request):
         request.session['profile_messagetype'] = 'danger'
         return redirect('profile')
 
+CHECKABLE_STATES = [u'unchecked', u'available', u'unavailable']
+"""Domain states listed as the availability results of a project"""
+PROJECT_PAGE_SIZE = 100
+"""Default number of domains (or metrics) returned per page of project details"""
+PROJECT_PAGE_MAX_SIZE = 1000
+"""Maximum number of domains (or metrics) that may be requested per page of project details"""
+
+def get_user_project(request):
+    """
+    Returns the project given by the 'id' parameter of a request, or None if it does not exist or belongs to another user.
+    """
+    try:
+        return UserProject.objects.get(id=int(request.GET['id']), user_id=request.user.id)
+    except (KeyError, ValueError, UserProject.DoesNotExist):
+        return None
+
+def get_page_size(request):
+    """
+    Returns the page size given by the 'limit' parameter of a request (within PROJECT_PAGE_MAX_SIZE), or PROJECT_PAGE_SIZE if not given.
+    """
+    try:
+        return max(1, min(int(request.GET.get('limit', PROJECT_PAGE_SIZE)), PROJECT_PAGE_MAX_SIZE))
+    except ValueError:
+        return PROJECT_PAGE_SIZE
+
+def get_domain_page(project, states=None, after=None, descending=False, page_size=PROJECT_PAGE_SIZE):
+    """
+    Returns a page of the given project's domains ordered by state then domain name.  Pages are selected by keyset (the state and domain name of the last domain of the previous page), so every page is read through the (project, state, domain) index no matter how far into the project it is.
+
+    Args:
+      project (UserProject): The project whose domains to list.
+      states (list): The domain states to include, or None for all states.
+      after (tuple): The (state, domain) of the last domain of the previous page, or None for the first page.
+      descending (bool): Whether to list in descending rather than ascending order.
+      page_size (int): Maximum number of domains on the page.
+
+    Returns:
+      A tuple of the list of domains and the (state, domain) to request the next page with (or None if this is the last page).
+    """
+    domains = ProjectDomain.objects.filter(project=project)
+    if states is not None:
+        domains = domains.filter(state__in=states)
+    if after is not None:
+        (state, domain) = after
+        if descending:
+            domains = domains.filter(Q(state__lt=state) | Q(state=state, domain__lt=domain))
+        else:
+            domains = domains.filter(Q(state__gt=state) | Q(state=state, domain__gt=domain))
+    ordering = ['-state', '-domain'] if descending else ['state', 'domain']
+    domains = list(domains.order_by(*ordering)[:page_size+1])
+    if len(domains) > page_size:
+        return (domains[:page_size], (domains[page_size-1].state, domains[page_size-1].domain))
+    return (domains, None)
+
+@login_required(login_url='/')
+def project_domains(request):
+    """
+    View:  Returns a page of a project's domains in JSON form, for an authenticated user.  The request parameters are:
+
+      * id: The project ID.
+      * state: Comma-separated domain states to include (all states if not given).
+      * order: 'asc' (the default) or 'desc' by state then domain name.
+      * after_state, after_domain: The 'next' keyset of the previous page (the first page if not given).
+      * limit: Number of domains per page.
+    """
+    result = {'result' : 'failure'}
+    project = get_user_project(request)
+    if project is not None:
+        states = request.GET['state'].split(u',') if request.GET.get('state') else None
+        after = (request.GET['after_state'], request.GET['after_domain']) if 'after_state' in request.GET and 'after_domain' in request.GET else None
+        (domains, next_after) = get_domain_page(project, states, after, request.GET.get('order') == 'desc', get_page_size(request))
+        result['result'] = 'success'
+        result['domains'] = [{
+            'domain' : d.domain,
+            'state' : d.state,
+            'is_checked' : d.is_checked,
+            'last_checked' : unicode(d.last_checked) if d.is_checked else None,
+            'error' : d.error} for d in domains]
+        result['next'] = None if next_after is None else {'after_state' : next_after[0], 'after_domain' : next_after[1]}
+    return HttpResponse(json.dumps(result), content_type='application/json')
+
+def get_metrics_page(project, after=None, page_size=PROJECT_PAGE_SIZE):
+    """
+    Returns a page of the given project's measured URL metrics ordered by query URL.  Pages are selected by keyset (the query URL of the last metrics of the previous page).
+
+    Args:
+      project (UserProject): The project whose metrics to list.
+      after (str): The query URL of the last metrics of the previous page, or None for the first page.
+      page_size (int): Maximum number of metrics on the page.
+
+    Returns:
+      A tuple of the list of URLMetrics and the query URL to request the next page with (or None if this is the last page).
+    """
+    metrics = project.get_measured_domains()
+    if after is not None:
+        metrics = metrics.filter(query_url__gt=after)
+    metrics = list(metrics.order_by('query_url')[:page_size+1])
+    if len(metrics) > page_size:
+        return (metrics[:page_size], metrics[page_size-1].query_url)
+    return (metrics, None)
+
+@login_required(login_url='/')
+def project_metrics(request):
+    """
+    View:  Returns a page of a project's measured URL metrics in JSON form, for an authenticated user.  The request parameters are:
+
+      * id: The project ID.
+      * after: The 'next' query URL of the previous page (the first page if not given).
+      * limit: Number of metrics per page.
+    """
+    result = {'result' : 'failure'}
+    project = get_user_project(request)
+    if project is not None:
+        (metrics, next_after) = get_metrics_page(project, request.GET.get('after'), get_page_size(request))
+        result['result'] = 'success'
+        result['metrics'] = [{
+            'query_url' : m.query_url,
+            'mozrank_10' : m.mozrank_10,
+            'links' : m.links,
+            'page_authority' : m.page_authority,
+            'domain_authority' : m.domain_authority} for m in metrics]
+        result['next'] = None if next_after is None else {'after' : next_after}
+    return HttpResponse(json.dumps(result), content_type='application/json')
+
+@login_required(login_url='/')
+def project_export(request):
+    """
+    View:  Downloads the availability results and URL metrics of a project for an authenticated user, in the format given by the 'format' parameter ('csv' or 'jsonl').  The file is streamed as it is read from the database (see export_rows), so memory use does not grow with the project size.
+    """
+    project = get_user_project(request)
+    export_format = request.GET.get('format', u'csv')
+    if project is None or export_format not in EXPORT_FORMATS:
+        request.session['profile_message'] = 'The specified project does not exist or belongs to another user.' if project is None else 'Unknown export format "%s".' % export_format
+        request.session['profile_messagetype'] = 'danger'
+        return redirect('project_list')
+    (formatter, content_type) = EXPORT_FORMATS[export_format]
+    filename = os.path.splitext(project.name())[0]
+    response = StreamingHttpResponse(formatter(export_rows(project)), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (filename.encode('ascii', 'replace').replace('"', ''), export_format)
+    return response
+
 @login_required(login_url='/')
 def manual_update_tlds(request):
     """
@@ -677,10 +646,13 @@ def manual_update_states(request):
         return redirect('index')
 
     for p in UserProject.objects.all():
-        p.update_state()
+        # A project moved into a working state has its work started straight away
+        work = p.update_state()
+        if work is not None:
+            start_project_task(p, PROJECT_TASKS[work], work)
         logger.debug(p.name)
-        logger.debug('  Measurable domains: %d' % len(p.get_measurable_domains()))
-        logger.debug('  Measured domains: %d' % len(p.get_measured_domains()))
+        logger.debug('  Measurable domains: %d' % p.get_counts().metrics_total)
+        logger.debug('  Measured domains: %d' % p.get_counts().metrics_checked)
 
     request.session['profile_message'] = 'Manual project state update complete.'
     request.session['profile_messagetype'] = 'success'
@@ -728,4 +700,5 @@ def admin_settings(request):
             'preserved' : preserved,
             'extensions' : extensions,
             'staff' : staff,
+            'availability_stats' : CacheStatistics.get(AVAILABILITY_CACHE_KEY),
             'admin' : admin})